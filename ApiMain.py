@@ -1,7 +1,6 @@
 from dotenv import load_dotenv
 import os
-from Models import DatabaseModel, GraphService, TransferScanner, \
-    CollectionService, ApiView, OpenSeaScraper, StatisticsService
+from Models import ApiView, ApplicationContext
 from rich.traceback import install
 
 install()
@@ -9,20 +8,33 @@ load_dotenv()
 
 infura_url = os.getenv("INFURA_URL")
 etherscan_api_key = os.getenv("ETHERSCAN_API_KEY")
+debug = os.getenv("API_DEBUG", "false").lower() == "true"
 
+# the objects are built once per process by the application context and reused by every call.
 def instantiate_main_objects():
-    db = DatabaseModel.DatabaseModel()
-    col_service = CollectionService.CollectionService()
-    graphs = GraphService.GraphService(db=db)
-    stats_service = StatisticsService.StatisticsService(db=db, graph_service=graphs)
-    scanner = TransferScanner.TransferScanner(infura_url, log_mode=True, db=db, collection_service=col_service)
-    scraper = OpenSeaScraper.OpenSeaScraper(db=db, etherscan_api_key=etherscan_api_key)
-    return db, graphs, col_service, scanner, scraper, stats_service
+    return ApplicationContext.get_context().as_tuple()
 
-def api_main():
+def create_api():
     (db, graphs, col_service, scanner, scraper, stats) = instantiate_main_objects()
-    api = ApiView.Api(db_model=db, graph_service=graphs, transfer_scanner=scanner, statistics_service=stats)
+    scan_jobs = ApplicationContext.get_context().scan_jobs
+    api = ApiView.Api(db_model=db, graph_service=graphs, transfer_scanner=scanner, statistics_service=stats, debug=debug,
+                      scan_jobs=scan_jobs, response_cache=ApplicationContext.get_context().response_cache)
     api.setup()
+    # work off the jobs that were queued before a restart, and requeue the ones a dead process left running. Under
+    # gunicorn this is done by a single ScanJobWorker.py process instead, see gunicorn.conf.py.
+    if scan_jobs.autostart:
+        scan_jobs.start()
+    return api
+
+# app factory for WSGI servers. Every worker process builds its own objects, e.g.
+#   gunicorn -c gunicorn.conf.py "ApiMain:create_app()"
+#   waitress-serve --threads 8 --call ApiMain:create_app
+def create_app():
+    return create_api().app
+
+def api_main():
+    api = create_api()
     api.start_api()
 
-api_main()
\ No newline at end of file
+if __name__ == '__main__':
+    api_main()
@@ -72,6 +72,20 @@ class Collection(Base):
         db_session.commit()
         return True
 
+    '''
+    same as set_collection_latest_block, but moves several collections to the same block with a single statement. Used 
+    when several collections are scanned in one pass.
+    '''
+    @staticmethod
+    def set_collections_latest_block(db_session: Session, contract_addresses: list, block_number: int):
+        if len(contract_addresses) == 0:
+            return False
+        stmnt = update(Collection).where(Collection.contract_address.in_(contract_addresses)).\
+            values(latest_block=block_number, last_update=datetime.now())
+        db_session.execute(stmnt)
+        db_session.commit()
+        return True
+
     '''
     function used to set the statistics attributes for a collection in the database.
     '''
@@ -100,6 +114,27 @@ class Collection(Base):
             return False
 
 
+    '''
+    function used to only set the block statistics of a collection, e.g. after an incremental update where the cycle 
+    statistics have not been recalculated.
+    '''
+    @staticmethod
+    def set_collection_block_statistics(db_session: Session, contract_address: str,
+                                        block_stats: Statistics.CollectionStatistics):
+        stmnt = update(Collection).where(Collection.contract_address == contract_address)\
+            .values(block_diff_average=block_stats.avg, block_diff_std=block_stats.std_deviation)
+        db_session.execute(stmnt)
+        return True
+
+    # same as set_collection_block_statistics, for the cycle statistics. Does not commit either.
+    @staticmethod
+    def set_collection_cycle_statistics(db_session: Session, contract_address: str,
+                                        cycle_stats: Statistics.TokenCycleStatistic):
+        stmnt = update(Collection).where(Collection.contract_address == contract_address)\
+            .values(cycle_average=cycle_stats.avg, cycle_std=cycle_stats.std_deviation)
+        db_session.execute(stmnt)
+        return True
+
     '''
     Retrieves a collection from the database as a Collection object.
     '''
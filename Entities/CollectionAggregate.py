@@ -0,0 +1,42 @@
+from __future__ import annotations
+from sqlalchemy import Column, \
+    Integer, VARCHAR, ForeignKey, select, update
+from Models import Base, Session
+
+'''
+Keeps track of how far the transfers of a collection have been folded into its TokenAggregates. Every transfer with a 
+block up to and including aggregated_block has been counted. A scan that starts at or below aggregated_block calls 
+invalidate_from, because the transfers it stores cannot be folded in out of order, and 
+StatisticsService.update_collection_stats_incremental then aggregates the collection again.
+'''
+class CollectionAggregate(Base):
+    __tablename__       = 'CollectionAggregates'
+    contract_address    = Column(VARCHAR(length=42), ForeignKey('Collections.contract_address'),
+                                 primary_key=True, nullable=False)
+    aggregated_block    = Column(Integer, nullable=False, default=-1)
+    token_count         = Column(Integer, nullable=False, default=0)
+
+    '''
+    returns the aggregate of a collection, and adds an empty one to the session if it does not exist yet.
+    '''
+    @staticmethod
+    def get_or_create(*, db_session: Session, contract_address: str) -> CollectionAggregate:
+        stmnt = select(CollectionAggregate).where(CollectionAggregate.contract_address == contract_address)
+        row = db_session.execute(stmnt).first()
+        if row is not None:
+            return row[0]
+        aggregate = CollectionAggregate(contract_address=contract_address, aggregated_block=-1, token_count=0)
+        db_session.add(aggregate)
+        return aggregate
+
+    '''
+    marks the aggregates of a collection for a rebuild if transfers from block on are about to be stored again.
+    '''
+    @staticmethod
+    def invalidate_from(*, db_session: Session, contract_address: str, block: int):
+        stmnt = update(CollectionAggregate) \
+            .where(CollectionAggregate.contract_address == contract_address) \
+            .where(CollectionAggregate.aggregated_block >= block) \
+            .values(aggregated_block=-1)
+        db_session.execute(stmnt)
+        db_session.commit()
@@ -1,8 +1,10 @@
 from __future__ import annotations
 from sqlalchemy import Column, \
     Integer, Boolean, VARCHAR, \
-    DateTime, ForeignKey, select, func, update, exists, delete, Float
+    DateTime, ForeignKey, Index, select, func, update, exists, delete, Float
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from Models import Base, Session, Utils
+from Models.Pagination import Pagination
 from rich.traceback import install
 from Entities import Statistics
 
@@ -25,6 +27,13 @@ class Token(Base):
     block_diff_std      = Column(Float, nullable=True, default=0)
     transfer_count      = Column(Integer, nullable=True, default=0)
 
+    # one index per sort key of get_tokens_in_collection, so every page is an index range scan.
+    __table_args__ = (
+        Index('ix_tokens_contract_transfer_count', 'contract_address', 'transfer_count', 'token_id'),
+        Index('ix_tokens_contract_cycle_count', 'contract_address', 'cycle_count', 'token_id'),
+        Index('ix_tokens_contract_block_diff_average', 'contract_address', 'block_diff_average', 'token_id'),
+    )
+
     def __repr__(self):
         return """
                     contract_address : %s
@@ -33,6 +42,9 @@ class Token(Base):
                     transfer_count: %s
                     """ % (self.contract_address, self.token_id, self.block_diff_average, self.transfer_count)
 
+    STATISTICS_COLUMNS = ["cycle_count", "block_diff_average", "block_diff_std", "transfer_count"]
+    SORT_COLUMNS = ["transfer_count", "cycle_count", "block_diff_average"]
+
     '''
     function to represent the Token as a database. Can be useful when converting object to json format.
     '''
@@ -59,13 +71,43 @@ class Token(Base):
         token = db_session.execute(stmnt).first()
         return token
 
+    '''
+    function to retrieve one page of the tokens of a collection, ordered by sort (one of SORT_COLUMNS) and token_id.
+    after is the [sort value, token_id] of the last token of the previous page, see Pagination. ranges maps columns of
+    STATISTICS_COLUMNS to (min, max) tuples, where either bound can be None. Tokens without a value for the sort 
+    column are left out.
+    '''
     @staticmethod
-    def get_tokens_in_collection(*, db_session: Session, contract_address: str) -> list[Token]:
-        stmnt = select(Token).where(Token.contract_address == contract_address).limit(100).order_by(Token.transfer_count.desc())
+    def get_tokens_in_collection(*, db_session: Session, contract_address: str, sort: str = "transfer_count",
+                                 descending: bool = True, limit: int = 100, after: list = None,
+                                 ranges: dict = None) -> list[Token]:
+        if sort not in Token.SORT_COLUMNS:
+            raise ValueError(f"cannot sort tokens by {sort}")
+        columns = [getattr(Token, sort), Token.token_id]
+        stmnt = select(Token) \
+            .where(Token.contract_address == contract_address) \
+            .where(columns[0].is_not(None))
+        for (column, (low, high)) in (ranges or {}).items():
+            if column not in Token.STATISTICS_COLUMNS:
+                raise ValueError(f"cannot filter tokens by {column}")
+            if low is not None:
+                stmnt = stmnt.where(getattr(Token, column) >= low)
+            if high is not None:
+                stmnt = stmnt.where(getattr(Token, column) <= high)
+        if after is not None:
+            stmnt = stmnt.where(Pagination.after(columns, after, descending=descending))
+        stmnt = stmnt.order_by(*Pagination.order_by(columns, descending=descending)).limit(limit)
 
         tokens = [x[0] for x in db_session.execute(stmnt).all()]
         return tokens
 
+    '''
+    cursor values of a token for get_tokens_in_collection.
+    '''
+    @staticmethod
+    def cursor_values(token: Token, sort: str) -> list:
+        return [getattr(token, sort), token.token_id]
+
     '''
     function to determine whether a token already exists in the database. If it does, it returns True and the token.
     '''
@@ -81,6 +123,52 @@ class Token(Base):
         length = len(token)
         return length > 0, token
 
+    '''
+    function that creates an insert statement which updates update_columns of tokens that already exist. Returns None 
+    if the dialect has no such statement.
+    '''
+    @staticmethod
+    def _upsert_statement(dialect_name: str, update_columns: list):
+        if dialect_name in ("mysql", "mariadb"):
+            stmnt = mysql.insert(Token)
+            return stmnt.on_duplicate_key_update({c: stmnt.inserted[c] for c in update_columns})
+        if dialect_name in ("postgresql", "sqlite"):
+            stmnt = (postgresql if dialect_name == "postgresql" else sqlite).insert(Token)
+            return stmnt.on_conflict_do_update(index_elements=["contract_address", "token_id"],
+                                               set_={c: stmnt.excluded[c] for c in update_columns})
+        return None
+
+    '''
+    writes the statistics of many tokens with batched upserts, updating the tokens that already exist instead of 
+    skipping them like add_token. tokens can be Token objects or dicts with the same keys. Everything is written in one
+    transaction, which is committed at the end together with anything else pending in the session, like the aggregates
+    of update_collection_stats_incremental. If it fails, the session is rolled back and the error is raised. Returns the
+    number of tokens written.
+    '''
+    @staticmethod
+    def bulk_upsert_tokens(*, db_session: Session, tokens: list, batch_size: int = 1000) -> int:
+        if len(tokens) == 0:
+            return 0
+        rows = [t.to_dict() if isinstance(t, Token) else t for t in tokens]
+        # only update the statistics that are actually given.
+        update_columns = [c for c in Token.STATISTICS_COLUMNS if c in rows[0]]
+        stmnt = Token._upsert_statement(db_session.get_bind().dialect.name, update_columns)
+
+        try:
+            for i in range(0, len(rows), batch_size):
+                batch = rows[i:i + batch_size]
+                if stmnt is not None:
+                    db_session.execute(stmnt, batch)
+                else:
+                    for row in batch:
+                        db_session.merge(Token(**row))
+            db_session.commit()
+        except Exception as e:
+            db_session.rollback()
+            print(f"could not upsert {len(rows)} tokens\n{e}")
+            raise
+        return len(rows)
+
     '''
     adds a token to the database if it does not have a block_diff_average of 0.
     '''
@@ -0,0 +1,86 @@
+from __future__ import annotations
+import math
+from sqlalchemy import Column, \
+    Integer, BigInteger, VARCHAR, ForeignKey, select
+from Models import Base, Session
+from Entities import Statistics
+
+tokenStats = Statistics.TokenStatistics
+
+'''
+Running aggregates of the block differences between the (non-mint) transfers of a token. They can be merged with new 
+transfers without reading the older ones again, which lets the statistics of a collection be updated incrementally.
+'''
+class TokenAggregate(Base):
+    __tablename__       = 'TokenAggregates'
+    contract_address    = Column(VARCHAR(length=42), ForeignKey('Collections.contract_address'),
+                                 primary_key=True, nullable=False)
+    token_id            = Column(Integer, nullable=False, primary_key=True)
+    transfer_count      = Column(Integer, nullable=False, default=0)
+    diff_sum            = Column(BigInteger, nullable=False, default=0)
+    diff_sum_squares    = Column(BigInteger, nullable=False, default=0)
+    min_diff            = Column(Integer, nullable=True)
+    max_diff            = Column(Integer, nullable=True)
+    min_non_zero_diff   = Column(Integer, nullable=True)
+    last_block          = Column(Integer, nullable=True)
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("transfer_count", 0)
+        kwargs.setdefault("diff_sum", 0)
+        kwargs.setdefault("diff_sum_squares", 0)
+        super().__init__(**kwargs)
+
+    # empties the aggregates, so the transfers of the token can be folded in again from the start.
+    def reset(self):
+        self.transfer_count = 0
+        self.diff_sum = 0
+        self.diff_sum_squares = 0
+        self.min_diff = None
+        self.max_diff = None
+        self.min_non_zero_diff = None
+        self.last_block = None
+
+    '''
+    folds the next transfer of the token into the aggregates. Blocks must be added in ascending order.
+    '''
+    def add_block(self, block: int):
+        if self.last_block is not None:
+            diff = block - self.last_block
+            self.diff_sum += diff
+            self.diff_sum_squares += diff * diff
+            self.min_diff = diff if self.min_diff is None else min(self.min_diff, diff)
+            self.max_diff = diff if self.max_diff is None else max(self.max_diff, diff)
+            if diff != 0:
+                self.min_non_zero_diff = diff if self.min_non_zero_diff is None else min(self.min_non_zero_diff, diff)
+        self.transfer_count += 1
+        self.last_block = block
+
+    '''
+    creates the same TokenStatistics as StatisticsService.calculate_statistics_collection, without the list of diffs.
+    The average is divided by the number of transfers, like in the full calculation.
+    '''
+    def to_token_statistics(self) -> Statistics.TokenStatistics:
+        stats = tokenStats()
+        n = self.transfer_count
+        if n == 0:
+            return stats
+        diff_count = n - 1
+        stats.total_count = n
+        stats.avg = self.diff_sum / n
+        # sum((d - avg)^2) written in terms of the running sums.
+        diff_sum = self.diff_sum_squares - 2 * stats.avg * self.diff_sum + diff_count * stats.avg ** 2
+        if diff_sum > 0 and diff_count != 0:
+            stats.std_deviation = math.sqrt(diff_sum / diff_count)
+        if self.min_diff is not None:
+            stats.fastest = self.min_diff
+        if self.max_diff is not None and self.max_diff != 0:
+            stats.slowest = self.max_diff
+        return stats
+
+    '''
+    returns the aggregates of every token in a collection as a dict with k = token_id and v = TokenAggregate.
+    '''
+    @staticmethod
+    def get_aggregates_in_collection(*, db_session: Session, contract_address: str) -> dict:
+        stmnt = select(TokenAggregate).where(TokenAggregate.contract_address == contract_address)
+        return {row[0].token_id: row[0] for row in db_session.execute(stmnt).all()}
@@ -2,7 +2,8 @@ from __future__ import annotations
 import math
 from sqlalchemy import Column, \
     Integer, Boolean, VARCHAR, \
-    DateTime, ForeignKey, select, func, update, exists, delete
+    DateTime, ForeignKey, Index, select, func, update, exists, delete, insert, tuple_, case
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from Models import Base, Session, Utils
 from rich.traceback import install
 from Entities import Statistics
@@ -22,6 +23,10 @@ class Transfer(Base):
     token_id            = Column(Integer, nullable=False)
     block               = Column(Integer, nullable=False)
 
+    __table_args__ = (
+        Index('ix_transfers_contract_block', 'contract_address', 'block'),
+    )
+
     def __repr__(self):
         return """
                     from : %s
@@ -81,6 +86,72 @@ class Transfer(Base):
         db_session.commit()
         return successful_additions
 
+    '''
+    function that represents the Transfer as a plain row, which is what the bulk insert statements expect.
+    '''
+    def to_row(self):
+        return {
+            "contract_address": self.contract_address,
+            "tx": self.tx,
+            "log_index": self.log_index,
+            "from_address": self.from_address,
+            "to_address": self.to_address,
+            "token_id": self.token_id,
+            "block": self.block
+        }
+
+    '''
+    function that creates an insert statement which silently skips transfers whose (tx, log_index) already exists. 
+    Returns None if the dialect has no such statement.
+    '''
+    @staticmethod
+    def _insert_ignore_statement(dialect_name: str):
+        if dialect_name in ("mysql", "mariadb"):
+            return mysql.insert(Transfer).prefix_with("IGNORE")
+        if dialect_name == "postgresql":
+            return postgresql.insert(Transfer).on_conflict_do_nothing(index_elements=["tx", "log_index"])
+        if dialect_name == "sqlite":
+            return sqlite.insert(Transfer).on_conflict_do_nothing(index_elements=["tx", "log_index"])
+        return None
+
+    '''
+    bulk version of add_transfer_list_to_db. Instead of checking every transfer with its own SELECT, the whole list is
+    written with a single executemany, and duplicates on (tx, log_index) are skipped by the database. Returns the number 
+    of transfers that were actually inserted. If the insert fails the session is rolled back and the error is raised, so
+    the scanner never moves the latest block of a collection past transfers that were not stored.
+    '''
+    @staticmethod
+    def bulk_add_transfer_list_to_db(db_session: Session, transfer_list: list) -> int:
+        if len(transfer_list) == 0:
+            return 0
+        # remove duplicates within the list itself, keeping the first occurrence.
+        rows = list({(r["tx"], r["log_index"]): r for r in reversed([
+            t.to_row() if isinstance(t, Transfer) else t for t in transfer_list
+        ])}.values())
+
+        try:
+            stmnt = Transfer._insert_ignore_statement(db_session.get_bind().dialect.name)
+            if stmnt is None:
+                # fall back to finding the existing keys with one query and only inserting the new rows.
+                keys = [(r["tx"], r["log_index"]) for r in rows]
+                existing = set(db_session.execute(
+                    select(Transfer.tx, Transfer.log_index).where(tuple_(Transfer.tx, Transfer.log_index).in_(keys))
+                ).all())
+                rows = [r for r in rows if (r["tx"], r["log_index"]) not in existing]
+                if len(rows) == 0:
+                    return 0
+                stmnt = insert(Transfer)
+
+            result = db_session.execute(stmnt, rows)
+            db_session.commit()
+        except Exception as e:
+            db_session.rollback()
+            print(f"could not bulk insert {len(rows)} transfers\n{e}")
+            raise
+
+        # some drivers do not report a row count for executemany.
+        return result.rowcount if result.rowcount >= 0 else len(rows)
+
     '''
     function that retrieves transfers that are connected to a collection by the contract_address.
     '''
@@ -95,6 +166,113 @@ class Transfer(Base):
 
         return transfer_rows
 
+    '''
+    streaming version of get_ordered_transfers_from_collection. The rows are read from a server-side cursor in chunks of
+    chunk_size, so the history of the collection is never held in memory at once. Only the columns needed for the 
+    statistics are selected. The connection of db_session is busy until the generator is exhausted, so writes have to
+    go through another session.
+    '''
+    @staticmethod
+    def stream_ordered_transfers_from_collection(*, db_session: Session, contract_address: str, chunk_size: int = 10000):
+        stmnt = select(Transfer.token_id, Transfer.block, Transfer.from_address, Transfer.to_address, Transfer.tx) \
+            .where(Transfer.contract_address == contract_address) \
+            .order_by(Transfer.token_id.asc(), Transfer.block.asc()) \
+            .execution_options(stream_results=True)
+
+        result = db_session.execute(stmnt)
+        for partition in result.partitions(chunk_size):
+            yield from partition
+
+    '''
+    function that streams the transfers of a single token in block order from a server-side cursor, with the columns
+    of DatabaseModel.get_token_transfers.
+    '''
+    @staticmethod
+    def stream_token_transfers(*, db_session: Session, contract_address: str, token_id: int, chunk_size: int = 10000):
+        stmnt = select(Transfer.tx, Transfer.block, Transfer.from_address, Transfer.to_address) \
+            .where(Transfer.contract_address == contract_address) \
+            .where(Transfer.token_id == token_id) \
+            .order_by(Transfer.block.asc(), Transfer.log_index.asc()) \
+            .execution_options(stream_results=True)
+
+        result = db_session.execute(stmnt)
+        for partition in result.partitions(chunk_size):
+            yield from partition
+
+    '''
+    function that streams the transfers of a collection in block order from a server-side cursor, for exports that
+    should not hold the collection in memory. from_block and to_block (inclusive) limit the block range. The connection 
+    of db_session is busy until the generator is exhausted.
+    '''
+    @staticmethod
+    def stream_transfers_from_collection(*, db_session: Session, contract_address: str, from_block: int = None,
+                                         to_block: int = None, chunk_size: int = 10000):
+        stmnt = select(Transfer.contract_address, Transfer.tx, Transfer.log_index, Transfer.block, Transfer.token_id,
+                       Transfer.from_address, Transfer.to_address) \
+            .where(Transfer.contract_address == contract_address)
+        if from_block is not None:
+            stmnt = stmnt.where(Transfer.block >= from_block)
+        if to_block is not None:
+            stmnt = stmnt.where(Transfer.block <= to_block)
+        stmnt = stmnt.order_by(Transfer.block.asc(), Transfer.tx.asc(), Transfer.log_index.asc()) \
+            .execution_options(stream_results=True)
+
+        result = db_session.execute(stmnt)
+        for partition in result.partitions(chunk_size):
+            yield partition
+
+    '''
+    function that creates a subquery with one row per token of a collection, containing the number of non-mint 
+    transfers and the sum, sum of squares, minimum, maximum and smallest non zero value of the block differences between
+    them, the same values as a TokenAggregate. The differences are calculated by the database with
+    LAG() OVER (PARTITION BY token_id ORDER BY block), so no transfers have to be loaded.
+    '''
+    @staticmethod
+    def block_diff_summary(*, contract_address: str, mint_address: str = "0000000000000000000000000000000000000000"):
+        previous_block = func.lag(Transfer.block).over(partition_by=Transfer.token_id, order_by=Transfer.block)
+        diffs = select(Transfer.token_id, (Transfer.block - previous_block).label('diff')) \
+            .where(Transfer.contract_address == contract_address) \
+            .where(Transfer.from_address != mint_address) \
+            .subquery()
+
+        # the first transfer of every token has no previous block. count() includes it, sum() skips it.
+        return select(diffs.c.token_id,
+                      func.count().label('transfer_count'),
+                      func.sum(diffs.c.diff).label('diff_sum'),
+                      func.sum(diffs.c.diff * diffs.c.diff).label('diff_sum_squares'),
+                      func.min(diffs.c.diff).label('min_diff'),
+                      func.max(diffs.c.diff).label('max_diff'),
+                      func.min(case((diffs.c.diff != 0, diffs.c.diff))).label('min_non_zero_diff')) \
+            .group_by(diffs.c.token_id) \
+            .subquery()
+
+    '''
+    function that only retrieves the token_id, block and from_address of the transfers of a collection, ordered by token
+    and block. If after_block is given, only transfers in later blocks are returned.
+    '''
+    @staticmethod
+    def get_token_blocks_from_collection(*, db_session: Session, contract_address: str, after_block: int = None):
+        stmnt = select(Transfer.token_id, Transfer.block, Transfer.from_address) \
+            .where(Transfer.contract_address == contract_address)
+        if after_block is not None:
+            stmnt = stmnt.where(Transfer.block > after_block)
+        stmnt = stmnt.order_by(Transfer.token_id.asc(), Transfer.block.asc())
+
+        return db_session.execute(stmnt).all()
+
+    '''
+    function that retrieves the columns needed to build the wallet graph of a collection. If after_block is given, only 
+    transfers in later blocks are returned, which is used to update a cached graph.
+    '''
+    @staticmethod
+    def get_graph_transfers_from_collection(*, db_session: Session, contract_address: str, after_block: int = None):
+        stmnt = select(Transfer.token_id, Transfer.block, Transfer.from_address, Transfer.to_address, Transfer.tx) \
+            .where(Transfer.contract_address == contract_address)
+        if after_block is not None:
+            stmnt = stmnt.where(Transfer.block > after_block)
+
+        return db_session.execute(stmnt).all()
+
 
 
 
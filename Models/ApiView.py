@@ -1,6 +1,14 @@
+import functools
+import traceback
+from urllib.parse import urlencode
 from contextvars import Token
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from Models import DatabaseModel, GraphService, TransferScanner, StatisticsService
+from Models.GraphExport import GraphExport
+from Models.ScanJobQueue import ScanJobQueue
+from Models.ResponseCache import ResponseCache, ALL_COLLECTIONS
+from Models.Pagination import Pagination
+from Models.TransferExport import TransferExport
 from flask_cors import CORS
 
 
@@ -10,26 +18,44 @@ class Api:
                  db_model: DatabaseModel.DatabaseModel,
                  graph_service: GraphService.GraphService,
                  transfer_scanner: TransferScanner.TransferScanner,
-                 statistics_service: StatisticsService.StatisticsService):
+                 statistics_service: StatisticsService.StatisticsService,
+                 debug: bool = False,
+                 scan_jobs: ScanJobQueue = None,
+                 response_cache: ResponseCache = None):
         self.app = Flask(__name__)
         self.db = db_model
         self.statistics_service = statistics_service
         self.graph_service = graph_service
         self.scanner = transfer_scanner
-        self.app.config['DEBUG'] = True
+        # without a job queue, /collection/add scans inside the request.
+        self.scan_jobs = scan_jobs
+        self.response_cache = response_cache
+        # the debugger and reloader are only meant for development, they serialize requests and keep tracebacks around.
+        self.debug = debug
+        self.app.config['DEBUG'] = debug
         self.app.config['JSON_SORT_KEYS'] = False
-        CORS(self.app, resources={r"*": {"origins": "*"}})
+        CORS(self.app, resources={r"*": {"origins": "*"}}, expose_headers=['X-Next-Cursor', 'Link'])
 
     # add endpoints here
     def setup(self):
         self._add_endpoint('/', self.index)
         self._add_endpoint('/collection/add', self.add_collection, methods=['POST'])
-        self._add_endpoint('/collection/all', self.get_all_collections)
-        # self._add_endpoint('/collection/status/<string:collectionID>', self.get_collection_status)
-        self._add_endpoint('/collection/<string:collectionID>', self.get_contract_token_transfers)
-        self._add_endpoint('/collection/<string:collectionID>/stats', self.get_collection_stats)
-        self._add_endpoint('/collection/<string:collectionID>/token/<int:tokenID>', self.token_list)
-        self._add_endpoint('/collection/<string:collectionID>/token/<int:tokenID>/stats', self.get_token_statistics)
+        self._add_endpoint('/collection/all', self._cached(self.get_all_collections))
+        self._add_endpoint('/collection/status/<string:collectionID>', self.get_collection_status)
+        self._add_endpoint('/job/<string:jobID>', self.get_job)
+        self._add_endpoint('/collection/<string:collectionID>',
+                           self._cached(self.get_contract_token_transfers, 'collectionID'))
+        self._add_endpoint('/collection/<string:collectionID>/stats',
+                           self._cached(self.get_collection_stats, 'collectionID'))
+        self._add_endpoint('/collection/<string:collectionID>/token/<int:tokenID>',
+                           self._cached(self.token_list, 'collectionID'))
+        self._add_endpoint('/collection/<string:collectionID>/token/<int:tokenID>/stats',
+                           self._cached(self.get_token_statistics, 'collectionID'))
+        self._add_endpoint('/collection/<string:collectionID>/address/<string:addressID>',
+                           self._cached(self.collectionAddress, 'collectionID'))
+        self._add_endpoint('/collection/<string:collectionID>/components',
+                           self._cached(self.get_collection_components, 'collectionID'))
+        self._add_endpoint('/collection/<string:collectionID>/export', self.export_collection_transfers)
         self._add_endpoint('/group/<collectionID>', self.collectionGroup)
 
     def index(self):
@@ -43,6 +69,14 @@ class Api:
                 'exception': 'collection string length does not fit'
             }
 
+        if self.scan_jobs is not None:
+            # the scan runs in the background, the client polls /job/<id> or /collection/status/<id>.
+            job = self.scan_jobs.submit(contract_address)
+            response = jsonify({"collection": job["contract_address"], "job_id": job["id"], "status": job["status"]})
+            response.status_code = 202
+            response.headers.add('Access-Control-Allow-Origin', '*')
+            return response
+
         res = self.scanner.scan_with_progressbar(contract_address=contract_address)
         
         with self.db.start_session() as session:
@@ -54,6 +88,24 @@ class Api:
 
         return response
 
+    def get_collection_status(self, collectionID):
+        job = self.scan_jobs.latest(collectionID) if self.scan_jobs is not None else None
+        if job is None:
+            return {'exception': 'no scan job for this collection'}, 404
+
+        response = jsonify(job)
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        return response
+
+    def get_job(self, jobID):
+        job = self.scan_jobs.get(jobID) if self.scan_jobs is not None else None
+        if job is None:
+            return {'exception': 'job not found'}, 404
+
+        response = jsonify(job)
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        return response
+
     def get_all_collections(self):
 
         with self.db.start_session() as session:
@@ -64,17 +116,53 @@ class Api:
 
         return response
 
+    # returns a page of the tokens of a collection. ?sort= transfer_count (default), cycle_count or block_diff_average,
+    # ?order=asc|desc, ?limit= and ?cursor= from the X-Next-Cursor header of the previous page. Every statistics column
+    # can be filtered with ?min_<column>= and ?max_<column>=.
     def get_contract_token_transfers(self, collectionID):
+        sort = request.args.get('sort', default='transfer_count')
+        descending = request.args.get('order', default='desc') != 'asc'
+        ranges = {}
+        for column in self.db.tokens.STATISTICS_COLUMNS:
+            (low, high) = (request.args.get(f'min_{column}', type=float), request.args.get(f'max_{column}', type=float))
+            if low is not None or high is not None:
+                ranges[column] = (low, high)
 
         with self.db.start_session() as session:
-            tokens = self.db.tokens.get_tokens_in_collection(db_session=session, contract_address=collectionID)
+            try:
+                (limit, after) = self._page_args(cursor_length=2)
+                tokens = self.db.tokens.get_tokens_in_collection(db_session=session, contract_address=collectionID,
+                                                                 sort=sort, descending=descending, limit=limit,
+                                                                 after=after, ranges=ranges)
+            except ValueError as e:
+                return {'exception': str(e)}, 400
         
             response = jsonify([t.to_dict() for t in tokens])
+            if len(tokens) == limit:
+                self._add_next_cursor(response, self.db.tokens.cursor_values(tokens[-1], sort))
 
             response.headers.add('Access-Control-Allow-Origin', '*')
 
         return response
 
+    # reads ?limit= and ?cursor= of a paginated endpoint. Raises ValueError for a malformed cursor.
+    @staticmethod
+    def _page_args(*, cursor_length: int):
+        limit = Pagination.clamp_limit(request.args.get('limit', type=int))
+        cursor = request.args.get('cursor')
+        after = Pagination.decode_cursor(cursor, cursor_length) if cursor else None
+        return limit, after
+
+    # the cursor of the next page goes into headers, so the body stays the list the frontend already reads.
+    @staticmethod
+    def _add_next_cursor(response, values: list):
+        cursor = Pagination.encode_cursor(values)
+        args = request.args.to_dict()
+        args['cursor'] = cursor
+        query = urlencode(args)
+        response.headers['X-Next-Cursor'] = cursor
+        response.headers['Link'] = f'<{request.base_url}?{query}>; rel="next"'
+
 
     # @app.route('/collection/<string:collectionID>')
     # def collection(collectionID):
@@ -97,21 +185,34 @@ class Api:
 
         return response
 
+    # returns the transfer graph of a token in the node-link format. ?format=compact returns the addresses once and
+    # the links as arrays, ?stream=true streams the node-link json in chunks.
     def token_list(self, collectionID, tokenID):
+        if request.args.get('stream', default=False, type=lambda v: v.lower() == 'true') \
+                and request.args.get('format') != 'compact':
+            # the transfers are read while the response is sent, by a session that lives as long as the response.
+            def generate():
+                with self.db.start_session() as session:
+                    yield from GraphExport.iter_node_link_json(
+                        lambda: self.db.transfers.stream_token_transfers(db_session=session,
+                                                                         contract_address=collectionID,
+                                                                         token_id=tokenID))
+
+            response = Response(generate(), mimetype='application/json')
+            response.headers.add('Access-Control-Allow-Origin', '*')
+            return response
+
         # starts a session
         with self.db.start_session() as session:
             # gets transfers for a certain token
             result = self.db.get_token_transfers(db_session=session, contract_address=collectionID, token_id=tokenID)
 
-            # creates a graph from those transfers
-            graph = self.graph_service.create_token_graph(result)
-
-            # exports to format readable by the frontend
-            json_graph = self.graph_service.export_json(graph)
-
-            # convert to json and
-            response = jsonify(json_graph)
-            response.headers.add('Access-Control-Allow-Origin', '*')
+        # exports to format readable by the frontend, without building a networkx graph
+        if request.args.get('format') == 'compact':
+            response = Response(GraphExport.compact_json(result), mimetype='application/json')
+        else:
+            response = Response(GraphExport.node_link_json(result), mimetype='application/json')
+        response.headers.add('Access-Control-Allow-Origin', '*')
 
         return response
 
@@ -129,22 +230,121 @@ class Api:
         raise NotImplementedError("Not yet implemented");
 
     def collectionAddress(self, collectionID, addressID):
-        raise NotImplementedError("Not yet implemented");
+        hops = request.args.get('hops', default=2, type=int)
+        top = request.args.get('top', default=10, type=int)
+        with self.db.start_session() as session:
+            summary = self.graph_service.wallet_summary(db_session=session, contract_address=collectionID,
+                                                        address=addressID, hops=min(hops, 4), top=top)
+        if summary is None:
+            return {'exception': 'collection not found'}, 404
 
-    def collectionGroup(self, collectionID):
-        db = DatabaseModel.DatabaseModel()
-        with db.start_session() as session:
-            result = db.get_grouped_transfers(db_session=session, contract_address=collectionID)
+        response = jsonify(summary)
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        return response
 
-            list = [((db.group_to_dict(row))) for row in result]
+    def get_collection_components(self, collectionID):
+        with self.db.start_session() as session:
+            graph = self.graph_service.get_collection_graph(db_session=session, contract_address=collectionID)
+        if graph is None:
+            return {'exception': 'collection not found'}, 404
+
+        sizes = graph.component_sizes()
+        response = jsonify({"wallets": len(graph.addresses), "transfers": graph.edge_count,
+                            "components": len(sizes), "component_sizes": sizes})
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        return response
 
-        return jsonify(list)
+    # returns a page of the transfers of a collection in block order, with the same ?limit= and ?cursor= as the token
+    # list. ?from_block= and ?to_block= limit the block range. With ?format=ndjson or csv all transfers in the range
+    # are streamed instead, like /collection/<id>/export.
+    def collectionGroup(self, collectionID):
+        if request.args.get('format') is not None:
+            return self.export_collection_transfers(collectionID)
+        from_block = request.args.get('from_block', type=int)
+        to_block = request.args.get('to_block', type=int)
+        with self.db.start_session() as session:
+            try:
+                (limit, after) = self._page_args(cursor_length=3)
+            except ValueError as e:
+                return {'exception': str(e)}, 400
+            result = self.db.get_grouped_transfers(db_session=session, contract_address=collectionID, limit=limit,
+                                                   after=after, from_block=from_block, to_block=to_block)
+
+            list = [((self.db.group_to_dict(row))) for row in result]
+
+        response = jsonify(list)
+        if len(result) == limit:
+            last = result[-1]
+            self._add_next_cursor(response, [last.block, last.tx, last.log_index])
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        return response
+
+    # streams every transfer of a collection in block order as ?format=ndjson (default) or csv, straight from a
+    # server-side cursor. ?from_block= and ?to_block= limit the block range.
+    def export_collection_transfers(self, collectionID):
+        export_format = request.args.get('format', default='ndjson')
+        if export_format not in TransferExport.formats:
+            return {'exception': f'format must be one of {", ".join(TransferExport.formats)}'}, 400
+        from_block = request.args.get('from_block', type=int)
+        to_block = request.args.get('to_block', type=int)
+        with self.db.start_session() as session:
+            (collection_exists, _) = self.db.collections.collection_exists(session, collectionID)
+        if not collection_exists:
+            return {'exception': 'collection not found'}, 404
+
+        # the session lives as long as the response is being sent and is closed when the client goes away.
+        def generate():
+            try:
+                with self.db.start_session() as session:
+                    partitions = self.db.transfers.stream_transfers_from_collection(db_session=session,
+                                                                                    contract_address=collectionID,
+                                                                                    from_block=from_block,
+                                                                                    to_block=to_block)
+                    yield from TransferExport.iter_export(partitions, export_format)
+            except Exception as e:
+                # the 200 is already sent, so the client can only tell from the last line that rows are missing.
+                print(f"export of {collectionID} failed")
+                traceback.print_exc()
+                yield TransferExport.error_line(export_format, e)
+
+        response = Response(generate(), mimetype=TransferExport.formats[export_format])
+        response.headers['Content-Disposition'] = f'attachment; filename={collectionID}.{export_format}'
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        return response
 
     def address(self, addressID):
         raise NotImplementedError("Not yet implemented");
 
-    def start_api(self):
-        self.app.run(debug=True)
+    # runs the werkzeug development server. In production the app is served by a WSGI server instead, see
+    # ApiMain.create_app.
+    def start_api(self, host: str = '127.0.0.1', port: int = 5000):
+        self.app.run(host=host, port=port, debug=self.debug, threaded=True)
+
+    # wraps a view so its responses are served from the response cache until the collection in the url argument
+    # scope_arg is invalidated, or any collection when scope_arg is None. Responses carry an ETag, and a request with a
+    # matching If-None-Match gets a 304 without a body. Only complete 200 responses are cached.
+    def _cached(self, view, scope_arg: str = None):
+        @functools.wraps(view)
+        def cached_view(**kwargs):
+            if self.response_cache is None:
+                return view(**kwargs)
+            scope = kwargs[scope_arg] if scope_arg is not None else ALL_COLLECTIONS
+            key = request.full_path
+            hit = self.response_cache.get(scope, key)
+            if hit is None:
+                generation = self.response_cache.generation(scope)
+                response = self.app.make_response(view(**kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                headers = {k: v for (k, v) in response.headers.items() if k in ('X-Next-Cursor', 'Link')}
+                self.response_cache.set(scope, key, response.get_data(), response.mimetype, generation=generation,
+                                        headers=headers)
+            else:
+                response = Response(hit[0], mimetype=hit[1], headers=hit[2])
+                response.headers.add('Access-Control-Allow-Origin', '*')
+            response.add_etag()
+            return response.make_conditional(request)
+        return cached_view
 
     def _add_endpoint(self, endpoint, method, methods: list = ['GET']):
         self.app.add_url_rule(rule=endpoint, endpoint=method.__name__, view_func=method, methods=methods)
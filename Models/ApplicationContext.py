@@ -0,0 +1,126 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from Models import DatabaseModel, GraphService, TransferScanner, CollectionService, OpenSeaScraper, StatisticsService
+from Models.ScanJobQueue import ScanJobQueue
+from Models.ResponseCache import ResponseCache
+
+load_dotenv()
+
+'''
+Long-lived container for the services used by the entry points in main.py and ApiMain.py. Every service is built the 
+first time it is asked for and then reused, so jobs that run over many collections only pay the setup cost once. The 
+services share one database engine and one pooled HTTP session for the node.
+'''
+class ApplicationContext:
+
+    def __init__(self, *, provider_url: str = None, etherscan_api_key: str = None, http_pool_size: int = 16):
+        self.provider_url = provider_url if provider_url is not None else os.getenv("INFURA_URL")
+        self.etherscan_api_key = etherscan_api_key if etherscan_api_key is not None else os.getenv("ETHERSCAN_API_KEY")
+        self.http_pool_size = http_pool_size
+        self._services = {}
+        self._lock = threading.RLock()
+
+    def _get(self, name: str, factory):
+        with self._lock:
+            if name not in self._services:
+                self._services[name] = factory()
+            return self._services[name]
+
+    def _create_http_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.http_pool_size, pool_maxsize=self.http_pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @property
+    def http_session(self) -> requests.Session:
+        return self._get("http_session", self._create_http_session)
+
+    @property
+    def db(self) -> DatabaseModel.DatabaseModel:
+        return self._get("db", DatabaseModel.DatabaseModel)
+
+    @property
+    def collection_service(self) -> CollectionService.CollectionService:
+        return self._get("collection_service", CollectionService.CollectionService)
+
+    @property
+    def graph_service(self) -> GraphService.GraphService:
+        return self._get("graph_service", lambda: GraphService.GraphService(db=self.db))
+
+    @property
+    def statistics_service(self) -> StatisticsService.StatisticsService:
+        return self._get("statistics_service",
+                         lambda: StatisticsService.StatisticsService(
+                             db=self.db, graph_service=self.graph_service, response_cache=self.response_cache,
+                             streaming=os.getenv("STATISTICS_STREAMING", "false").lower() == "true"))
+
+    # shared through a sqlite file by default, so scans started from main.py also invalidate the responses of the api.
+    # RESPONSE_CACHE=memory keeps the cache inside the process. RESPONSE_CACHE_MAX_BYTES caps the memory of the bodies.
+    @property
+    def response_cache(self) -> ResponseCache:
+        path = os.getenv("RESPONSE_CACHE", "response_cache.sqlite")
+        return self._get("response_cache", lambda: ResponseCache(
+            path=None if path == "memory" else path, ttl=float(os.getenv("RESPONSE_CACHE_TTL", 300)),
+            max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))))
+
+    # SCAN_WORKERS > 1 scans the block range of a collection in parallel, SCAN_PIPELINED=true overlaps fetching and
+    # storing the chunks instead. Used by every scan that does not choose itself, like the scan jobs and main.py.
+    def _create_scanner(self) -> TransferScanner.TransferScanner:
+        scanner = TransferScanner.TransferScanner(
+            self.provider_url, log_mode=True, db=self.db, collection_service=self.collection_service,
+            statistics_service=self.statistics_service, http_session=self.http_session,
+            response_cache=self.response_cache, wallet_graphs=self.graph_service.wallet_graphs)
+        scanner.workers = int(os.getenv("SCAN_WORKERS", 1))
+        scanner.pipelined = os.getenv("SCAN_PIPELINED", "false").lower() == "true"
+        return scanner
+
+    @property
+    def scanner(self) -> TransferScanner.TransferScanner:
+        return self._get("scanner", self._create_scanner)
+
+    @property
+    def scraper(self) -> OpenSeaScraper.OpenSeaScraper:
+        return self._get("scraper", lambda: OpenSeaScraper.OpenSeaScraper(
+            db=self.db, etherscan_api_key=self.etherscan_api_key, collection_service=self.collection_service))
+
+    # scans a collection for a background job and updates its statistics. The result keeps the chunk size decisions of
+    # the scan, see TransferScanner.chunk_metrics.
+    def _run_scan_job(self, contract_address: str, progress) -> dict:
+        (events, blocks, api_calls) = self.scanner.scan_with_progressbar(contract_address=contract_address,
+                                                                         progress_bar=progress)
+        with self.db.start_session() as session:
+            collection = self.db.collections.get_collection(db_session=session, contract_address=contract_address)
+            self.statistics_service.insert_collections_stats(db_session=session, collection=collection)
+        return {"events": events, "blocks": blocks, "api_calls": api_calls,
+                "chunk_metrics": self.scanner.chunk_metrics()}
+
+    # SCAN_JOB_AUTOSTART=false only queues the jobs, for processes that must not scan themselves, like the gunicorn
+    # workers. ScanJobWorker.py then runs them.
+    @property
+    def scan_jobs(self) -> ScanJobQueue:
+        return self._get("scan_jobs", lambda: ScanJobQueue(
+            runner=self._run_scan_job, path=os.getenv("SCAN_JOB_DB", "scan_jobs.sqlite"),
+            workers=int(os.getenv("SCAN_JOB_WORKERS", 1)),
+            autostart=os.getenv("SCAN_JOB_AUTOSTART", "true").lower() == "true"))
+
+    # same order as the tuple that instantiate_main_objects has always returned.
+    def as_tuple(self):
+        return self.db, self.graph_service, self.collection_service, self.scanner, self.scraper, self.statistics_service
+
+
+_context = None
+_context_lock = threading.Lock()
+
+
+# returns the context shared by the whole process.
+def get_context() -> ApplicationContext:
+    global _context
+    with _context_lock:
+        if _context is None:
+            _context = ApplicationContext()
+    return _context
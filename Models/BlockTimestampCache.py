@@ -0,0 +1,68 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+'''
+Cache for block number -> timestamp. Lookups go through an in-memory LRU first and then through a small sqlite file, so
+timestamps fetched by one process can be reused by the next one. The sqlite file is only opened on first use.
+Timestamps of blocks close to the head of the chain can still change because of reorgs, so callers should only store
+blocks that are old enough.
+'''
+class BlockTimestampCache:
+
+    def __init__(self, path: str = "block_timestamps.sqlite", max_memory_entries: int = 10000):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()
+        self._connection = None
+        self._lock = threading.Lock()
+        # metrics
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS block_timestamps (block INTEGER PRIMARY KEY, timestamp INTEGER NOT NULL)")
+            self._connection.commit()
+        return self._connection
+
+    def _remember(self, block: int, timestamp: int):
+        self._memory[block] = timestamp
+        self._memory.move_to_end(block)
+        if len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    '''
+    returns the cached timestamp of a block, or None if it has not been cached yet.
+    '''
+    def get(self, block: int):
+        with self._lock:
+            if block in self._memory:
+                self._memory.move_to_end(block)
+                self.hits += 1
+                return self._memory[block]
+
+            row = self._connect().execute("SELECT timestamp FROM block_timestamps WHERE block = ?", (block,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(block, row[0])
+            return row[0]
+
+    def set(self, block: int, timestamp: int):
+        with self._lock:
+            self._remember(block, timestamp)
+            connection = self._connect()
+            connection.execute("INSERT OR REPLACE INTO block_timestamps (block, timestamp) VALUES (?, ?)",
+                               (block, timestamp))
+            connection.commit()
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
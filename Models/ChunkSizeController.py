@@ -0,0 +1,107 @@
+from collections import deque
+
+
+'''
+Controller that decides how many blocks the scanner should ask for in the next request. It keeps a running estimate of
+the event density (events per block) and of the time it takes the node to answer per block, and picks the largest chunk
+that is expected to stay below both target_events and latency_budget. A range refused by the node is bisected instead of
+starting over from min_chunk_size.
+One controller keeps the state of one scan, so parallel scans should each use their own.
+'''
+class ChunkSizeController:
+
+    def __init__(self, *,
+                 min_chunk_size: int = 20,
+                 max_chunk_size: int = 10000,
+                 target_events: int = 5000,
+                 provider_limit: int = 10000,
+                 latency_budget: float = 10.0,
+                 max_growth: float = 2.0,
+                 smoothing: float = 0.5,
+                 history: int = 50):
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.target_events = target_events
+        self.provider_limit = provider_limit
+        self.latency_budget = latency_budget
+        self.max_growth = max_growth
+        # weight of the latest chunk in the running estimates. 1 only uses the latest chunk.
+        self.smoothing = smoothing
+
+        self.density = None  # estimated events per block
+        self.seconds_per_block = None  # estimated response time per block
+
+        # metrics
+        self.chunks = 0
+        self.refused = 0
+        self.events = 0
+        self.blocks = 0
+        self.decisions = deque(maxlen=history)  # (chunk size, reason) of the most recent decisions
+
+    def _smooth(self, estimate, value):
+        if estimate is None:
+            return value
+        return self.smoothing * value + (1 - self.smoothing) * estimate
+
+    def _clamp(self, chunk_size) -> int:
+        return int(max(self.min_chunk_size, min(self.max_chunk_size, chunk_size)))
+
+    '''
+    records a chunk that was fetched successfully and returns the chunk size to use for the next request.
+    '''
+    def record(self, *, chunk_size: int, blocks: int, events: int, seconds: float = None) -> int:
+        self.chunks += 1
+        self.events += events
+        self.blocks += blocks
+        blocks = max(1, blocks)
+        self.density = self._smooth(self.density, events / blocks)
+        if seconds is not None:
+            self.seconds_per_block = self._smooth(self.seconds_per_block, seconds / blocks)
+
+        candidates = [(chunk_size * self.max_growth, "growth")]
+        if self.density > 0:
+            candidates.append((self.target_events / self.density, "events"))
+        if self.seconds_per_block is not None and self.seconds_per_block > 0:
+            candidates.append((self.latency_budget / self.seconds_per_block, "latency"))
+
+        (next_chunk_size, reason) = min(candidates)
+        return self._decide(next_chunk_size, reason)
+
+    '''
+    records a range that the node refused because it contained more than provider_limit events, and returns a chunk
+    size that is at most half of the refused one.
+    '''
+    def refuse(self, *, chunk_size: int) -> int:
+        self.refused += 1
+        blocks = max(1, chunk_size)
+        # the refused range holds at least provider_limit events.
+        self.density = max(self.density or 0, self.provider_limit / blocks)
+        next_chunk_size = min(chunk_size // 2, self.target_events / self.density)
+        return self._decide(next_chunk_size, "refused")
+
+    def _decide(self, chunk_size, reason) -> int:
+        chunk_size = self._clamp(chunk_size)
+        self.decisions.append((chunk_size, reason))
+        return chunk_size
+
+    def metrics(self) -> dict:
+        return {
+            "chunks": self.chunks,
+            "refused": self.refused,
+            "events": self.events,
+            "blocks": self.blocks,
+            "density": self.density,
+            "seconds_per_block": self.seconds_per_block,
+            "last_decision": self.decisions[-1] if len(self.decisions) > 0 else None
+        }
+
+    @staticmethod
+    def merge_metrics(controllers: list) -> dict:
+        metrics = {"chunks": 0, "refused": 0, "events": 0, "blocks": 0, "reasons": {}}
+        for controller in controllers:
+            for k in ("chunks", "refused", "events", "blocks"):
+                metrics[k] += getattr(controller, k)
+            for (_, reason) in controller.decisions:
+                metrics["reasons"][reason] = metrics["reasons"].get(reason, 0) + 1
+        metrics["density"] = metrics["events"] / metrics["blocks"] if metrics["blocks"] > 0 else None
+        return metrics
@@ -1,4 +1,6 @@
 from datetime import datetime
+import threading
+import time
 import requests
 import arrow  # package for datetime conversion
 import json
@@ -6,6 +8,7 @@ from dataclasses import dataclass
 from web3 import Web3
 from dotenv import load_dotenv
 from Entities import OpenseaResponse
+from Models import BlockTimestampCache
 import os
 from rich.traceback import install
 
@@ -13,21 +16,55 @@ from rich.traceback import install
 install()
 OpenseaRes = OpenseaResponse.OpenseaResponse
 
-# the provider to make web3 api calls
-w3 = Web3(Web3.HTTPProvider("https://mainnet.infura.io/v3/8ee8f90dd1f949b68aed10e9a0b19c44"))
-# get the latest block.
-w3_latest_block = w3.eth.get_block('latest')['number']
 # load environment file to get opensea api key
 load_dotenv()
 OPENSEA_API_KEY = os.getenv('OS_API_KEY')
+PROVIDER_URL = os.getenv('INFURA_URL', "https://mainnet.infura.io/v3/8ee8f90dd1f949b68aed10e9a0b19c44")
+# number of seconds the latest block is reused before it is fetched again.
+LATEST_BLOCK_MAX_AGE = 60
+# blocks this close to the latest block can still be reorganized, so their timestamps are not cached.
+BLOCK_TIMESTAMP_CONFIRMATIONS = 64
+# block timestamps are shared by every start block estimation, also across processes through the file on disk.
+block_timestamps = BlockTimestampCache.BlockTimestampCache(
+    path=os.getenv('BLOCK_TIMESTAMP_CACHE', 'block_timestamps.sqlite'))
+
+# the provider to make web3 api calls. Created on first use, so importing this module does not need a network.
+_w3 = None
+_latest_block = (None, 0.0)  # (block number, time it was fetched)
+_lock = threading.Lock()
+
+
+def get_w3() -> Web3:
+    global _w3
+    with _lock:
+        if _w3 is None:
+            _w3 = Web3(Web3.HTTPProvider(PROVIDER_URL))
+    return _w3
+
+
+# get the latest block. It is fetched again once it is older than max_age seconds, so long running processes do not use
+# a stale block.
+def get_latest_block(max_age: float = LATEST_BLOCK_MAX_AGE) -> int:
+    global _latest_block
+    (block_number, fetched_at) = _latest_block
+    if block_number is None or time.time() - fetched_at > max_age:
+        block_number = get_w3().eth.get_block('latest')['number']
+        _latest_block = (block_number, time.time())
+    return block_number
+
 
 @dataclass
 class CollectionService:
 
-    # function to get timestamp of block
+    # function to get timestamp of block. Looks in the block timestamp cache before asking the node.
     @staticmethod
     def block_timestamp(i_block):
-        return w3.eth.get_block(i_block).timestamp
+        timestamp = block_timestamps.get(i_block)
+        if timestamp is None:
+            timestamp = get_w3().eth.get_block(i_block).timestamp
+            if i_block <= get_latest_block() - BLOCK_TIMESTAMP_CONFIRMATIONS:
+                block_timestamps.set(i_block, timestamp)
+        return timestamp
 
     # given a contract address, returns details about the collection. Specifically the section called "collection"
     # which contains information such as the created_at_date (used to determine the starting block), slug, and address.
@@ -61,13 +98,14 @@ class CollectionService:
     def __find_nearest_block_by_estimate(self, *,
                                          str_timestamp: str,
                                          block_low: int = 1,
-                                         block_high: int = w3_latest_block,
+                                         block_high: int = None,
                                          verbose: bool = False,
                                          depth: int = 0
                                          ) -> float:
         input_timestamp = arrow.get(str_timestamp).timestamp()
+        latest_block = get_latest_block()
         block_low = max(1, block_low)
-        block_high = min(w3_latest_block, block_high)
+        block_high = latest_block if block_high is None else min(latest_block, block_high)
         # subtract this value to ensure that the returned block is always before the creation of the collection.
         # necessary since we might be off by a few blocks.
         subtract_from_return_block = 100
@@ -165,7 +203,7 @@ class CollectionService:
             created_date = self.get_collection_create_date(slug=slug)
             print(f'slug: {slug}, created_date: {created_date}, timestamp: {arrow.get(created_date).timestamp()}')
             start_block = self.__find_nearest_block_by_estimate(
-                input_timestamp=created_date,
+                str_timestamp=created_date,
                 verbose=False)
             collections_dict[slug] = start_block
 
@@ -0,0 +1,149 @@
+import time
+from dataclasses import dataclass
+
+
+@dataclass
+class CycleCount:
+    count: int = 0
+    # True if the budget ran out before every cycle was counted. count is then a lower bound.
+    truncated: bool = False
+    work: int = 0
+
+
+'''
+Counts the simple cycles of a directed graph without materializing them, as a replacement for
+len(list(nx.simple_cycles(g))). Parallel edges and repeated self-loops count once, like in networkx.
+Cycles only exist inside strongly connected components, so those are found first and the search is restricted to them.
+Every cycle is counted exactly once from its smallest node, so the search from a node only visits larger nodes.
+The number of cycles can grow exponentially on wash-traded tokens, so the search can be bounded by:
+  max_length: cycles longer than this are not counted.
+  work_budget: maximum number of edges visited.
+  time_budget: maximum number of seconds spent on one graph.
+The graph is passed as edges (from, to), so it can be used with transfers without building a networkx graph.
+'''
+class CycleCounter:
+
+    def __init__(self, *, max_length: int = None, work_budget: int = None, time_budget: float = None):
+        self.max_length = max_length
+        self.work_budget = work_budget
+        self.time_budget = time_budget
+
+    '''
+    converts edges into adjacency sets of integers, so the search compares ints instead of addresses.
+    '''
+    @staticmethod
+    def to_adjacency(edges) -> (list, int):
+        index = {}
+        adjacency = []
+        self_loops = set()
+        for (u, v) in edges:
+            for node in (u, v):
+                if node not in index:
+                    index[node] = len(index)
+                    adjacency.append(set())
+            if u == v:
+                self_loops.add(index[u])
+            else:
+                adjacency[index[u]].add(index[v])
+        return adjacency, len(self_loops)
+
+    '''
+    iterative version of tarjan's algorithm. Returns a list of components, each a list of nodes.
+    '''
+    @staticmethod
+    def strongly_connected_components(adjacency: list) -> list:
+        index_of = [-1] * len(adjacency)
+        low = [0] * len(adjacency)
+        on_stack = [False] * len(adjacency)
+        stack = []
+        components = []
+        next_index = 0
+
+        for root in range(len(adjacency)):
+            if index_of[root] != -1:
+                continue
+            work = [(root, iter(adjacency[root]))]
+            index_of[root] = low[root] = next_index
+            next_index += 1
+            stack.append(root)
+            on_stack[root] = True
+            while work:
+                (node, neighbours) = work[-1]
+                advanced = False
+                for neighbour in neighbours:
+                    if index_of[neighbour] == -1:
+                        index_of[neighbour] = low[neighbour] = next_index
+                        next_index += 1
+                        stack.append(neighbour)
+                        on_stack[neighbour] = True
+                        work.append((neighbour, iter(adjacency[neighbour])))
+                        advanced = True
+                        break
+                    elif on_stack[neighbour]:
+                        low[node] = min(low[node], index_of[neighbour])
+                if advanced:
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index_of[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+        return components
+
+    def count_edges(self, edges) -> CycleCount:
+        (adjacency, self_loops) = CycleCounter.to_adjacency(edges)
+        return self.count(adjacency, self_loops=self_loops)
+
+    def count(self, adjacency: list, *, self_loops: int = 0) -> CycleCount:
+        result = CycleCount()
+        if self.max_length is None or self.max_length >= 1:
+            result.count = self_loops
+        deadline = time.monotonic() + self.time_budget if self.time_budget is not None else None
+        # time.monotonic is cheap, but there is no need to call it for every edge.
+        next_clock_check = 0
+        max_length = self.max_length if self.max_length is not None else len(adjacency)
+
+        for component in CycleCounter.strongly_connected_components(adjacency):
+            if len(component) < 2 or max_length < 2:
+                continue
+            members = set(component)
+            for start in sorted(component):
+                # depth first search over paths start -> ... -> start that only use nodes larger than start.
+                path = [start]
+                on_path = {start}
+                work = [iter(adjacency[start])]
+                while work:
+                    node = None
+                    for neighbour in work[-1]:
+                        result.work += 1
+                        if neighbour == start:
+                            result.count += 1
+                        elif neighbour > start and neighbour in members and neighbour not in on_path \
+                                and len(path) < max_length:
+                            node = neighbour
+                            break
+                    if node is None:
+                        work.pop()
+                        on_path.discard(path.pop())
+                    else:
+                        path.append(node)
+                        on_path.add(node)
+                        work.append(iter(adjacency[node]))
+
+                    if self.work_budget is not None and result.work >= self.work_budget:
+                        result.truncated = True
+                        return result
+                    if deadline is not None and result.work >= next_clock_check:
+                        next_clock_check = result.work + 1024
+                        if time.monotonic() > deadline:
+                            result.truncated = True
+                            return result
+        return result
@@ -1,7 +1,8 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from Models import Base, Session, engine, tables_exist
-from Entities import Collection, Transfer, Slug, Token
+from Models import Base, Session, get_engine
+from Entities import Collection, Transfer, Slug, Token, TokenAggregate, CollectionAggregate
+from Models.Pagination import Pagination
 from sqlalchemy import Column, \
     Integer, Boolean, VARCHAR, \
     DateTime, ForeignKey, select, func, update, exists, delete, and_, tuple_, distinct, text
@@ -23,18 +24,35 @@ class DatabaseModel:
         self.transfers: Transfer = Transfer.Transfer
         self.slugs: Slug = Slug.Slug
         self.tokens: Token = Token.Token
-        if not len(engine.table_names()) == len(Base.__subclasses__()):
-            self.create_tables()
-
-    @staticmethod
-    def start_session():
+        self.token_aggregates: TokenAggregate = TokenAggregate.TokenAggregate
+        self.collection_aggregates: CollectionAggregate = CollectionAggregate.CollectionAggregate
+        # the database is only contacted when the first session is started.
+        self._tables_checked = False
+
+    def start_session(self):
+        if not self._tables_checked:
+            if not len(get_engine().table_names()) == len(Base.__subclasses__()):
+                self.create_tables()
+            self.create_missing_indexes()
+            self._tables_checked = True
         return Session()
 
     @staticmethod
     def create_tables():
-        Base.metadata.create_all(engine)
+        Base.metadata.create_all(get_engine())
         return 1
 
+    '''
+    create_all only creates the indexes of tables it creates itself, so indexes that were added to a table later are
+    created here on databases that already have the table.
+    '''
+    @staticmethod
+    def create_missing_indexes():
+        engine = get_engine()
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+
     @staticmethod
     def create_column():
         Base.metadata
@@ -55,16 +73,31 @@ class DatabaseModel:
         except Exception as ex:
             print(ex)
 
-    # when grouping the transfers by tx, we create a list of tokens to go along with it labelled as "tokens".
+    # returns the transfers of a collection ordered by block, tx and log_index. If limit is given only one page is
+    # returned, which continues after the [block, tx, log_index] of the last transfer of the previous page.
+    # from_block and to_block (inclusive) limit the block range.
     @staticmethod
-    def get_grouped_transfers(*, db_session: Session, contract_address: str = None):
+    def get_grouped_transfers(*, db_session: Session, contract_address: str = None, limit: int = None,
+                              after: list = None, from_block: int = None, to_block: int = None):
+        columns = [Transfer.Transfer.block, Transfer.Transfer.tx, Transfer.Transfer.log_index]
         stmnt = select(
             Transfer.Transfer.from_address, 
             Transfer.Transfer.to_address,
             Transfer.Transfer.tx,
-            Transfer.Transfer.block
+            Transfer.Transfer.block,
+            Transfer.Transfer.log_index,
+            Transfer.Transfer.token_id
         )\
             .where(Transfer.Transfer.contract_address == contract_address)\
+            .order_by(*Pagination.order_by(columns))
+        if from_block is not None:
+            stmnt = stmnt.where(Transfer.Transfer.block >= from_block)
+        if to_block is not None:
+            stmnt = stmnt.where(Transfer.Transfer.block <= to_block)
+        if after is not None:
+            stmnt = stmnt.where(Pagination.after(columns, after))
+        if limit is not None:
+            stmnt = stmnt.limit(limit)
 
         rows = db_session.execute(stmnt).all()
         return rows
@@ -128,7 +161,8 @@ class DatabaseModel:
             "tx" : group.tx,
             "to": group.to_address,
             "from": group.from_address,
-            "tokens": group.tokens.split(",")
+            "block": group.block,
+            "token_id": group.token_id
         }
 
 
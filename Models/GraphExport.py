@@ -0,0 +1,121 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library encoder is used without it.
+    orjson = None
+
+MINT_ADDRESS = "0000000000000000000000000000000000000000"
+
+
+'''
+Serializes token transfers straight into the node-link json the frontend reads, without building a networkx graph and
+without the dict trees of json_graph.node_link_data. The result has the same nodes and links as exporting
+create_token_graph with networkx 2.x: every sender and receiver is a node, except the mint address, and every transfer
+that is not a mint is a link with block, tx, source, target and key, where key numbers the parallel transfers between
+the same two wallets. The links are in transfer order though, while networkx groups them by their source node, so
+clients must not rely on the order of the links.
+Transfers are expected as rows with from_address, to_address, block and tx, like DatabaseModel.get_token_transfers.
+'''
+class GraphExport:
+
+    @staticmethod
+    def dumps(data) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(data)
+        return json.dumps(data, separators=(",", ":")).encode()
+
+    @staticmethod
+    def _nodes_and_links(transfers):
+        transfers = sorted(transfers, key=lambda t: t.block)
+        nodes = {}
+        for t in transfers:
+            if t.from_address != MINT_ADDRESS:
+                nodes.setdefault(t.from_address, len(nodes))
+            nodes.setdefault(t.to_address, len(nodes))
+
+        keys = {}
+        links = []
+        for t in transfers:
+            if t.from_address == MINT_ADDRESS:
+                continue
+            key = keys.get((t.from_address, t.to_address), 0)
+            keys[(t.from_address, t.to_address)] = key + 1
+            links.append((t.from_address, t.to_address, t.block, t.tx, key))
+        return nodes, links
+
+    @staticmethod
+    def node_link_data(transfers) -> dict:
+        (nodes, links) = GraphExport._nodes_and_links(transfers)
+        return {
+            "directed": True,
+            "multigraph": True,
+            "graph": {},
+            "nodes": [{"id": address} for address in nodes],
+            "links": [{"block": block, "tx": tx, "source": source, "target": target, "key": key}
+                      for (source, target, block, tx, key) in links]
+        }
+
+    @staticmethod
+    def node_link_json(transfers) -> bytes:
+        return GraphExport.dumps(GraphExport.node_link_data(transfers))
+
+    # json of the items, without the brackets of the list, and with a leading comma unless they are the first ones.
+    @staticmethod
+    def _json_items(items: list, first: bool) -> bytes:
+        chunk = GraphExport.dumps(items)[1:-1]
+        return chunk if first else b"," + chunk
+
+    '''
+    same json as node_link_json, but written while the transfers are read, in pieces of chunk_size nodes or links, so a
+    large token is streamed to the client without loading its transfers or holding the document in memory. Only the
+    addresses and the number of transfers per pair of wallets are kept. The nodes come before the links, so the 
+    transfers are read twice: stream_transfers is called once per pass and must return the transfers of the token in 
+    block order, e.g. from a server-side cursor.
+    '''
+    @staticmethod
+    def iter_node_link_json(stream_transfers, chunk_size: int = 1000):
+        yield b'{"directed":true,"multigraph":true,"graph":{},"nodes":['
+        seen = set()
+        (nodes, first) = ([], True)
+        for t in stream_transfers():
+            for address in ((t.to_address,) if t.from_address == MINT_ADDRESS else (t.from_address, t.to_address)):
+                if address not in seen:
+                    seen.add(address)
+                    nodes.append({"id": address})
+            if len(nodes) >= chunk_size:
+                yield GraphExport._json_items(nodes, first)
+                (nodes, first) = ([], False)
+        if len(nodes) > 0:
+            yield GraphExport._json_items(nodes, first)
+
+        yield b'],"links":['
+        keys = {}
+        (links, first) = ([], True)
+        for t in stream_transfers():
+            if t.from_address == MINT_ADDRESS:
+                continue
+            key = keys.get((t.from_address, t.to_address), 0)
+            keys[(t.from_address, t.to_address)] = key + 1
+            links.append({"block": t.block, "tx": t.tx, "source": t.from_address, "target": t.to_address, "key": key})
+            if len(links) >= chunk_size:
+                yield GraphExport._json_items(links, first)
+                (links, first) = ([], False)
+        if len(links) > 0:
+            yield GraphExport._json_items(links, first)
+        yield b']}'
+
+    '''
+    compact variant: the addresses are listed once and every link is an array [source index, target index, block, tx].
+    '''
+    @staticmethod
+    def compact_data(transfers) -> dict:
+        (nodes, links) = GraphExport._nodes_and_links(transfers)
+        return {
+            "nodes": list(nodes),
+            "links": [[nodes[source], nodes[target], block, tx] for (source, target, block, tx, _) in links]
+        }
+
+    @staticmethod
+    def compact_json(transfers) -> bytes:
+        return GraphExport.dumps(GraphExport.compact_data(transfers))
@@ -1,7 +1,11 @@
 import math
+import os
 
 from Models import DatabaseModel, Session
 from Entities import Statistics
+from Models.CycleCounter import CycleCounter
+from Models.TransferGraph import TransferGraph
+from Models.WalletGraphCache import WalletGraphCache
 import networkx as nx
 from networkx.readwrite import json_graph
 
@@ -12,35 +16,45 @@ from networkx.readwrite import json_graph
 # These factors lead us to use a MultiDiGraph.
 class GraphService:
 
+    # bounds of the cycle search of a single token. Wash-traded tokens can have exponentially many cycles, so a token
+    # that runs out of budget is counted with the cycles found so far. The counts are stored, so the budget is only
+    # counted in work and not in time, which would make them depend on the machine and its load.
+    cycle_counter = CycleCounter(max_length=None, work_budget=2000000)
+
     def __init__(self, db: DatabaseModel.DatabaseModel):
         self.db = db
+        self.wallet_graphs = WalletGraphCache(db=db, cache_dir=os.getenv("WALLET_GRAPH_CACHE", "wallet_graphs"))
 
     # takes a list of transfers, which is created using DatabaseModel.get_grouped_transfers()
     def create_multigraph(self, *, transfers: list, include_mint: bool = True):
-        g = nx.MultiDiGraph()
-        # weights = [] # todo: find better weight than number of tokens. Should probably be price when we have that.
-        for transfer in transfers:
-            # weights.append(len(transfer.tokens))
-            self._add_transfer_as_node(g=g, transfer=transfer, include_mint=include_mint)
-        return g
+        # todo: find better weight than number of tokens. Should probably be price when we have that.
+        return TransferGraph.from_transfers(transfers).to_networkx(include_mint=include_mint)
 
     @staticmethod
     def get_subgraphs(g):
         return g.subgraph()
 
-    @staticmethod
-    def _add_transfer_as_node(*, g, transfer, include_mint: bool):
-        if not include_mint:
-            if transfer.from_address != "0000000000000000000000000000000000000000":
-                g.add_node(transfer.from_address)
-                g.add_node(transfer.to_address)
-                g.add_edge(transfer.from_address, transfer.to_address, block=transfer.block, tx=transfer.tx)
-            else:
-                g.add_node(transfer.to_address)
-        else:
-            g.add_node(transfer.from_address)
-            g.add_node(transfer.to_address)
-            g.add_edge(transfer.from_address, transfer.to_address, block=transfer.block, tx=transfer.tx)
+    # returns the cached wallet graph of a whole collection, or None if the collection does not exist, see
+    # WalletGraphCache.
+    def get_collection_graph(self, *, db_session: Session, contract_address: str) -> TransferGraph:
+        return self.wallet_graphs.get(db_session=db_session, contract_address=contract_address)
+
+    # summary of a wallet in the wallet graph of a collection, used to explore wash trading rings. None if the
+    # collection does not exist.
+    def wallet_summary(self, *, db_session: Session, contract_address: str, address: str, hops: int = 2,
+                       top: int = 10) -> dict:
+        graph = self.get_collection_graph(db_session=db_session, contract_address=contract_address)
+        if graph is None:
+            return None
+        (neighborhood, truncated) = graph.k_hop_neighborhood(address, k=hops)
+        return {
+            "address": address,
+            "degree": graph.degree(address),
+            "top_counterparties": graph.top_counterparties(address, n=top),
+            "component_size": len(graph.component_of(address)),
+            "neighborhood": neighborhood,
+            "neighborhood_truncated": truncated
+        }
 
     @staticmethod
     def export_json(nx_graph):
@@ -48,10 +62,8 @@ class GraphService:
 
     @staticmethod
     def create_token_graph(transfers: list):
-        g = nx.MultiDiGraph()  # is a multiDigraph to support selfloops and parraleledges.
-        for transfer in transfers:
-            GraphService._add_transfer_as_node(g=g, transfer=transfer, include_mint=False)
-        return g
+        # is a multiDigraph to support selfloops and parraleledges.
+        return TransferGraph.from_transfers(transfers).to_networkx(include_mint=False)
 
     # noinspection PyTypeChecker
     # todo: if there are no transfers, dont run this :)
@@ -59,21 +71,26 @@ class GraphService:
     def calculate_token_graph_statistics(*, transfers):
         if len(transfers) == 0:
             return None, None
-        graph_dict = {}
         cycle_dict = {}
         collection_stats = Statistics.TokenCycleStatistic()
 
-        # we have to create the graphs before we can calculate any sort of statistics
-        GraphService._populate_dicts(cycle_dict, graph_dict, transfers)
+        # we have to create the graph before we can calculate any sort of statistics
+        graph = TransferGraph.from_transfers([row[0] for row in transfers])
 
         cycles_acc = 0
-        # calculate cycles in each graph and add the result to the cycle_dict
-        for k, v in graph_dict.items():
-            nr_of_cycles = len(list(nx.simple_cycles(v)))
-            cycle_dict[k] = nr_of_cycles
-            cycles_acc += nr_of_cycles
-
-        graph_dict = None
+        truncated = []
+        # count cycles in each token and add the result to the cycle_dict
+        for k, result in graph.count_cycles(GraphService.cycle_counter).items():
+            cycle_dict[k] = result.count
+            cycles_acc += result.count
+            if result.truncated:
+                truncated.append(k)
+
+        graph = None
+        if len(truncated) > 0:
+            # the stored cycle_count of these tokens is a lower bound.
+            print(f"cycle count of {len(truncated)} tokens of {transfers[0][0].contract_address} stopped at the work "
+                  f"budget of {GraphService.cycle_counter.work_budget}, token ids: {sorted(truncated)}")
 
         tokens_count = len(cycle_dict)
         # calculate average and sd for collection
@@ -90,12 +107,46 @@ class GraphService:
         return collection_stats, cycle_dict
 
 
+    # counts the cycles of a single token the same way as calculate_token_graph_statistics. transfers are rows with
+    # from_address and to_address.
     @staticmethod
-    def _populate_dicts(cycle_dict, graph_dict, transfers):
+    def count_token_cycles(transfers) -> int:
+        graph = TransferGraph.from_transfers(transfers)
+        (adjacency, self_loops) = graph.token_adjacency(graph.tokens()[0]) if graph.edge_count > 0 else ([], 0)
+        return GraphService.cycle_counter.count(adjacency, self_loops=self_loops).count
+
+    # cheap wash trading signals of a single token, computed in linear time instead of enumerating cycles.
+    # transfers are rows with from_address and to_address, ordered by block.
+    #   scc_sizes: sizes of the strongly connected components with more than one wallet, largest first.
+    #   reciprocal_pairs: pairs of wallets that transferred the token to each other in both directions.
+    #   round_trips: transfers A->B that are directly followed by B->A.
+    @staticmethod
+    def token_wash_trading_signals(transfers) -> dict:
+        transfers = [t for t in transfers if t.from_address != "0000000000000000000000000000000000000000"]
+        edges = set((t.from_address, t.to_address) for t in transfers if t.from_address != t.to_address)
+        (adjacency, self_loops) = CycleCounter.to_adjacency(edges)
+        scc_sizes = sorted((len(c) for c in CycleCounter.strongly_connected_components(adjacency) if len(c) > 1),
+                           reverse=True)
+        reciprocal_pairs = sum(1 for (u, v) in edges if (v, u) in edges) // 2
+        round_trips = 0
+        for i in range(len(transfers) - 1):
+            if transfers[i].from_address == transfers[i + 1].to_address \
+                    and transfers[i].to_address == transfers[i + 1].from_address:
+                round_trips += 1
+
+        return {
+            "scc_sizes": scc_sizes,
+            "largest_scc": scc_sizes[0] if len(scc_sizes) > 0 else 0,
+            "reciprocal_pairs": reciprocal_pairs,
+            "round_trips": round_trips
+        }
+
+    # wash trading signals of every token in a collection. transfers is the result of
+    # get_ordered_transfers_from_collection.
+    @staticmethod
+    def calculate_wash_trading_signals(*, transfers) -> dict:
+        token_transfers = {}
         for row in transfers:
-            token = row[0]  # get the TokenTransfer from the statement
-            graph_dict.setdefault(token.token_id, nx.MultiDiGraph())
-            cycle_dict.setdefault(token.token_id, 0)
-            if token.from_address != "0000000000000000000000000000000000000000":
-                graph_dict[token.token_id].add_edge(token.from_address, token.to_address, tx=token.tx)
-
+            token = row[0]
+            token_transfers.setdefault(token.token_id, []).append(token)
+        return {k: GraphService.token_wash_trading_signals(v) for k, v in token_transfers.items()}
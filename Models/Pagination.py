@@ -0,0 +1,55 @@
+import base64
+import json
+
+from sqlalchemy import and_, or_
+
+
+'''
+Helpers for keyset (cursor) pagination. Instead of an OFFSET, which makes the database skip every earlier row, a page
+continues after the sort values of the last row of the previous page, so every page costs the same when an index covers
+the sort columns. The cursor handed to clients is those values as url safe base64 json.
+'''
+class Pagination:
+
+    max_limit = 1000
+
+    @staticmethod
+    def encode_cursor(values: list) -> str:
+        return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode()).decode().rstrip("=")
+
+    '''
+    returns the values of a cursor, or raises ValueError if the cursor is malformed or has the wrong number of values.
+    '''
+    @staticmethod
+    def decode_cursor(cursor: str, length: int) -> list:
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        except (ValueError, TypeError):
+            raise ValueError("invalid cursor")
+        if not isinstance(values, list) or len(values) != length:
+            raise ValueError("invalid cursor")
+        return values
+
+    '''
+    condition for the rows that come after values when ordering by columns, all ascending or all descending. It is
+    written out as (a > x) OR (a = x AND b > y) ..., because not every database uses an index for row comparisons.
+    The columns must not be NULL.
+    '''
+    @staticmethod
+    def after(columns: list, values: list, descending: bool = False):
+        conditions = []
+        for i in range(len(columns)):
+            equal = [columns[j] == values[j] for j in range(i)]
+            beyond = columns[i] < values[i] if descending else columns[i] > values[i]
+            conditions.append(and_(*equal, beyond))
+        return or_(*conditions)
+
+    @staticmethod
+    def order_by(columns: list, descending: bool = False) -> list:
+        return [c.desc() if descending else c.asc() for c in columns]
+
+    @staticmethod
+    def clamp_limit(limit: int, default: int = 100) -> int:
+        if limit is None:
+            return default
+        return max(1, min(Pagination.max_limit, limit))
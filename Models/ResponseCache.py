@@ -0,0 +1,158 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+ALL_COLLECTIONS = "*"
+
+
+'''
+Cache for the responses of the read endpoints. Entries are grouped by collection, and every collection has a generation
+number that invalidate() increments, which makes all cached responses of that collection stale at once. Responses that
+depend on every collection, like /collection/all, use ALL_COLLECTIONS, which is invalidated together with any collection.
+Responses are kept in an in-memory LRU of at most max_entries responses and max_bytes of bodies, and expire after ttl
+seconds. If path is given, the generations and the responses are also stored in a sqlite file, so several API processes
+and the scanner in main.py share them and an invalidation in one process is seen by all of them. Expired responses and
+responses of an older generation are purged from the file every purge_interval seconds.
+'''
+class ResponseCache:
+
+    def __init__(self, *, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024, ttl: float = 300.0,
+                 path: str = None, purge_interval: float = 60.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.path = path
+        self.purge_interval = purge_interval
+        # k = key, v = (scope, generation, expires, body, mimetype, headers)
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._last_purge = time.time()
+        self._generations = {}
+        self._connection = None
+        self._lock = threading.Lock()
+        # metrics
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS generations (scope TEXT PRIMARY KEY, generation INTEGER NOT NULL)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, scope TEXT NOT NULL, "
+                "generation INTEGER NOT NULL, expires REAL NOT NULL, mimetype TEXT, headers TEXT, body BLOB NOT NULL)")
+            # cache files written before the headers were cached have no headers column.
+            columns = [row[1] for row in self._connection.execute("PRAGMA table_info(responses)")]
+            if "headers" not in columns:
+                self._connection.execute("ALTER TABLE responses ADD COLUMN headers TEXT")
+        return self._connection
+
+    def _generation(self, scope: str) -> int:
+        if self.path is None:
+            return self._generations.get(scope, 0)
+        row = self._connect().execute("SELECT generation FROM generations WHERE scope = ?", (scope,)).fetchone()
+        return row[0] if row is not None else 0
+
+    '''
+    returns the current generation of a collection. Read it before building a response and pass it to set, so a response
+    built from data that was invalidated in the meantime is not cached as fresh.
+    '''
+    def generation(self, scope: str) -> int:
+        with self._lock:
+            return self._generation(scope.lower())
+
+    '''
+    returns (body, mimetype, headers) of a cached response, or None.
+    '''
+    def get(self, scope: str, key: str):
+        scope = scope.lower()
+        with self._lock:
+            generation = self._generation(scope)
+            entry = self._memory.get(key)
+            if entry is not None and entry[1] == generation and entry[2] > time.time():
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[3], entry[4], entry[5]
+
+            if self.path is not None:
+                row = self._connect().execute("SELECT body, mimetype, expires, headers FROM responses "
+                                              "WHERE key = ? AND generation = ?", (key, generation)).fetchone()
+                if row is not None and row[2] > time.time():
+                    headers = json.loads(row[3]) if row[3] is not None else {}
+                    self._remember(key, (scope, generation, row[2], bytes(row[0]), row[1], headers))
+                    self.hits += 1
+                    return bytes(row[0]), row[1], headers
+
+            self.misses += 1
+            return None
+
+    def set(self, scope: str, key: str, body: bytes, mimetype: str, generation: int = None, headers: dict = None):
+        scope = scope.lower()
+        with self._lock:
+            if generation is None:
+                generation = self._generation(scope)
+            expires = time.time() + self.ttl
+            headers = headers or {}
+            self._remember(key, (scope, generation, expires, body, mimetype, headers))
+            if self.path is not None:
+                self._connect().execute("INSERT OR REPLACE INTO responses (key, scope, generation, expires, mimetype, "
+                                        "headers, body) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                        (key, scope, generation, expires, mimetype, json.dumps(headers), body))
+            if time.time() - self._last_purge >= self.purge_interval:
+                self._purge()
+
+    def _remember(self, key: str, entry: tuple):
+        self._forget(key)
+        # a body larger than the whole cache would only evict everything else.
+        if len(entry[3]) > self.max_bytes:
+            return
+        self._memory[key] = entry
+        self._memory_bytes += len(entry[3])
+        while len(self._memory) > self.max_entries or self._memory_bytes > self.max_bytes:
+            (_, evicted) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted[3])
+
+    def _forget(self, key: str):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= len(entry[3])
+
+    # removes expired responses and responses of an older generation from memory and from the sqlite file.
+    def _purge(self):
+        now = time.time()
+        self._last_purge = now
+        generations = {scope: self._generation(scope) for (scope, *_) in self._memory.values()}
+        for (key, entry) in list(self._memory.items()):
+            if entry[2] <= now or entry[1] != generations[entry[0]]:
+                self._forget(key)
+        if self.path is not None:
+            self._connect().execute("DELETE FROM responses WHERE expires <= ? OR generation < (SELECT g.generation "
+                                    "FROM generations g WHERE g.scope = responses.scope)", (now,))
+
+    def purge(self):
+        with self._lock:
+            self._purge()
+
+    '''
+    makes the cached responses of the given collections stale, together with the ones that depend on all collections.
+    '''
+    def invalidate(self, *contract_addresses: str):
+        scopes = set(c.lower() for c in contract_addresses) | {ALL_COLLECTIONS}
+        with self._lock:
+            for key in [k for (k, entry) in self._memory.items() if entry[0] in scopes]:
+                self._forget(key)
+            for scope in scopes:
+                if self.path is None:
+                    self._generations[scope] = self._generations.get(scope, 0) + 1
+                else:
+                    connection = self._connect()
+                    connection.execute("INSERT INTO generations (scope, generation) VALUES (?, 1) "
+                                       "ON CONFLICT(scope) DO UPDATE SET generation = generation + 1", (scope,))
+                    connection.execute("DELETE FROM responses WHERE scope = ?", (scope,))
+
+    def metrics(self) -> dict:
+        return {"entries": len(self._memory), "bytes": self._memory_bytes, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,258 @@
+import json
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+'''
+Stands in for the tqdm progress bar of TransferScanner.scan_with_progressbar while a job runs in the background, and
+writes the scanner's counters into the job. Writes are throttled to one per interval seconds.
+'''
+class JobProgress:
+
+    def __init__(self, queue, job_id: str, interval: float = 1.0):
+        self.queue = queue
+        self.job_id = job_id
+        self.interval = interval
+        self.total = 0
+        self.n = 0
+        self.counters = {}
+        self._last_write = 0
+
+    def reset(self, total=None):
+        self.total = total or 0
+        self.n = 0
+        self._write(force=True)
+
+    def update(self, n=1):
+        self.n += n
+        self._write()
+
+    def set_description(self, desc=None, refresh=True):
+        pass
+
+    def set_counters(self, **counters):
+        self.counters.update(counters)
+
+    def close(self):
+        self._write(force=True)
+
+    def to_dict(self) -> dict:
+        progress = {"blocks_total": self.total, "blocks_scanned": self.n,
+                    "percent": round(100 * self.n / self.total, 2) if self.total > 0 else None}
+        progress.update(self.counters)
+        return progress
+
+    def _write(self, force: bool = False):
+        now = time.time()
+        if force or now - self._last_write >= self.interval:
+            self._last_write = now
+            # progress is only informative, a locked database should not fail the scan.
+            try:
+                self.queue.set_progress(self.job_id, self.to_dict())
+            except sqlite3.Error:
+                traceback.print_exc()
+
+
+'''
+Persistent queue of collection scans, kept in a small sqlite file so queued jobs survive a restart and can be shared by
+several API processes. submit returns the running or queued job of a contract instead of adding a second one.
+Contract addresses are stored in lowercase, like the transfers, so checksummed and lowercase addresses share their jobs.
+Worker threads claim jobs one at a time and pass them to runner(contract_address, progress), which scans the contract
+and reports through the JobProgress. While a job runs, a heartbeat thread updates its heartbeat every
+heartbeat_interval seconds, also while the scanner estimates the start block or the statistics are calculated. Jobs whose heartbeat is older than stale_after seconds, because the process that ran them died, are queued again.
+With autostart, submit starts the worker threads in the submitting process. Without it, jobs are only queued and the
+workers run in another process that calls start, see ScanJobWorker.py.
+'''
+class ScanJobQueue:
+
+    def __init__(self, *, runner, path: str = "scan_jobs.sqlite", workers: int = 1, poll_interval: float = 2.0,
+                 stale_after: float = 600.0, heartbeat_interval: float = 30.0, autostart: bool = True):
+        assert heartbeat_interval < stale_after
+        self.runner = runner
+        self.path = path
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.heartbeat_interval = heartbeat_interval
+        self.autostart = autostart
+        self._local = threading.local()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        with self._connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS scan_jobs (
+                    id TEXT PRIMARY KEY,
+                    contract_address TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    started REAL,
+                    finished REAL,
+                    heartbeat REAL,
+                    progress TEXT,
+                    result TEXT,
+                    error TEXT
+                )""")
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_scan_jobs_status ON scan_jobs (status, created)")
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_scan_jobs_contract ON scan_jobs (contract_address, created)")
+            # jobs queued before the addresses were normalized.
+            connection.execute("UPDATE scan_jobs SET contract_address = lower(contract_address) "
+                               "WHERE contract_address != lower(contract_address)")
+
+    # one connection per thread, sqlite connections should not be shared between threads.
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _to_dict(row) -> dict:
+        if row is None:
+            return None
+        job = dict(row)
+        for k in ("progress", "result"):
+            job[k] = json.loads(job[k]) if job[k] is not None else None
+        return job
+
+    '''
+    queues a scan of the contract, unless one is already queued or running. Returns the job.
+    '''
+    def submit(self, contract_address: str) -> dict:
+        contract_address = contract_address.strip().lower()
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT * FROM scan_jobs WHERE contract_address = ? AND status IN (?, ?) "
+                                     "ORDER BY created LIMIT 1", (contract_address, QUEUED, RUNNING)).fetchone()
+            if row is None:
+                job_id = uuid.uuid4().hex
+                connection.execute("INSERT INTO scan_jobs (id, contract_address, status, created) VALUES (?, ?, ?, ?)",
+                                   (job_id, contract_address, QUEUED, time.time()))
+                row = connection.execute("SELECT * FROM scan_jobs WHERE id = ?", (job_id,)).fetchone()
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        if self.autostart:
+            self.start()
+        self._wake.set()
+        return self._to_dict(row)
+
+    def get(self, job_id: str) -> dict:
+        row = self._connect().execute("SELECT * FROM scan_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row)
+
+    # returns the most recent job of a contract.
+    def latest(self, contract_address: str) -> dict:
+        row = self._connect().execute("SELECT * FROM scan_jobs WHERE contract_address = ? ORDER BY created DESC "
+                                      "LIMIT 1", (contract_address.strip().lower(),)).fetchone()
+        return self._to_dict(row)
+
+    def set_progress(self, job_id: str, progress: dict):
+        self._connect().execute("UPDATE scan_jobs SET progress = ?, heartbeat = ? WHERE id = ?",
+                                (json.dumps(progress), time.time(), job_id))
+
+    def _heartbeat(self, job_id: str, done: threading.Event):
+        while not done.wait(self.heartbeat_interval):
+            try:
+                self._connect().execute("UPDATE scan_jobs SET heartbeat = ? WHERE id = ?", (time.time(), job_id))
+            except sqlite3.Error:
+                traceback.print_exc()
+
+    def _claim(self) -> dict:
+        connection = self._connect()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("UPDATE scan_jobs SET status = ? WHERE status = ? AND heartbeat < ?",
+                               (QUEUED, RUNNING, now - self.stale_after))
+            row = connection.execute("SELECT * FROM scan_jobs WHERE status = ? ORDER BY created LIMIT 1",
+                                     (QUEUED,)).fetchone()
+            if row is not None:
+                connection.execute("UPDATE scan_jobs SET status = ?, started = ?, heartbeat = ? WHERE id = ?",
+                                   (RUNNING, now, now, row["id"]))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return self._to_dict(row)
+
+    def _finish(self, job_id: str, status: str, result=None, error: str = None):
+        self._connect().execute("UPDATE scan_jobs SET status = ?, finished = ?, result = ?, error = ? WHERE id = ?",
+                                (status, time.time(), json.dumps(result) if result is not None else None, error,
+                                 job_id))
+
+    # finish a job, retrying on sqlite errors, so a locked database does not leave the job running until it is stale.
+    def _finish_retrying(self, job_id: str, status: str, result=None, error: str = None):
+        while True:
+            try:
+                self._finish(job_id, status, result=result, error=error)
+                return
+            except sqlite3.Error:
+                traceback.print_exc()
+                if self._stop.wait(self.poll_interval):
+                    return
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.Error:
+                # e.g. "database is locked" by a concurrent submit. Back off and try again instead of ending the thread.
+                traceback.print_exc()
+                self._stop.wait(self.poll_interval)
+                continue
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+
+            progress = JobProgress(self, job["id"])
+            done = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat, args=(job["id"], done),
+                                         name=f"scan-job-heartbeat-{job['id']}", daemon=True)
+            heartbeat.start()
+            try:
+                try:
+                    result = self.runner(job["contract_address"], progress)
+                    progress.close()
+                except Exception as e:
+                    traceback.print_exc()
+                    self._finish_retrying(job["id"], FAILED, error=f"{type(e).__name__}: {e}")
+                else:
+                    self._finish_retrying(job["id"], DONE, result=result)
+            finally:
+                done.set()
+                heartbeat.join()
+
+    '''
+    starts the worker threads that are not running (anymore). Called when the api starts, so jobs queued before a
+    restart are picked up, by submit if autostart is set, and by ScanJobWorker.py.
+    '''
+    def start(self):
+        with self._start_lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._work, name=f"scan-job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
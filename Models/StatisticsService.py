@@ -1,16 +1,29 @@
 from dataclasses import dataclass
+from itertools import groupby
 import math
-from Models import DatabaseModel, GraphService, Session, Utils
+import multiprocessing
+import os
+import time
+import numpy as np
+from sqlalchemy import select
+from Models import DatabaseModel, GraphService, Session, Utils, get_engine
 from Entities import Token, Collection, Statistics, Transfer
 Token = Token.Token
 tokenStats = Statistics.TokenStatistics
 utils = Utils.Utils
 collectionStats = Statistics.CollectionStatistics
+MINT_ADDRESS = "0000000000000000000000000000000000000000"
 
 @dataclass
 class StatisticsService:
     graph_service: GraphService
     db: DatabaseModel.DatabaseModel
+    # calculate the block statistics with the numpy implementation instead of the python loops.
+    vectorized: bool = True
+    # calculate the statistics token by token from a server-side cursor, for collections that do not fit in memory.
+    streaming: bool = False
+    # cache of the api responses, invalidated for a collection when its statistics are written. See ResponseCache.
+    response_cache: object = None
 
     '''
     This method is used to go through all of the collections in the database and then calculating and inserting the
@@ -23,17 +36,54 @@ class StatisticsService:
                 collection = col[0]
                 self.insert_collections_stats(db_session=session, collection=collection)
 
+    '''
+    Same as populate_collection_stats, but the collections are spread over a pool of processes, so the cpu bound 
+    statistics of several collections are calculated at the same time. Every worker process creates its own database 
+    model and sessions with the database and settings of this service (see _worker_config), and only handles one 
+    collection at a time. Workers are replaced after 
+    max_collections_per_worker collections to give their memory back. Returns a list of 
+    (contract_address, seconds, error) for every collection, where error is None if the collection succeeded.
+    '''
+    def populate_collection_stats_parallel(self, *, processes: int = None, max_collections_per_worker: int = 10) -> list:
+        with self.db.start_session() as session:
+            contract_addresses = [col[0].contract_address
+                                  for col in self.db.collections.get_all_collections(db_session=session)]
+
+        timings = []
+        start = time.time()
+        # spawn gives every worker a fresh interpreter instead of a copy of this process and its database connections.
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(processes=processes, initializer=_init_statistics_worker, initargs=(self._worker_config(),),
+                          maxtasksperchild=max_collections_per_worker) as pool:
+            for (contract_address, seconds, error) in pool.imap_unordered(_insert_collection_stats_worker,
+                                                                           contract_addresses):
+                timings.append((contract_address, seconds, error))
+                self._invalidate_responses(contract_address)
+                status = "done" if error is None else f"failed: {error}"
+                print(f"({len(timings)} / {len(contract_addresses)}) {contract_address} {status} in {seconds:.1f}s")
+
+        print(f"calculated statistics for {len(contract_addresses)} collections in {time.time() - start:.1f}s")
+        return timings
+
     '''
     This method calculates the statistics for a single collection using two different methods. When the calculations are
     finished, it saves the results to the database.
     '''
     def insert_collections_stats(self,*, db_session: Session, collection: Collection):
+        if self.streaming:
+            self.insert_collections_stats_streaming(db_session=db_session, collection=collection)
+            return
         transfers = self.db.transfers. \
             get_ordered_transfers_from_collection(db_session=db_session,
                                                   contract_address=collection.contract_address)
         if len(transfers) != 0:
-            (collection_block_stats, token_block_dict) = StatisticsService.calculate_statistics_collection(
-                transfers=transfers)
+            if self.vectorized:
+                (token_ids, blocks, is_mint) = StatisticsService.transfers_to_arrays(transfers=transfers)
+                (collection_block_stats, token_block_dict) = StatisticsService.calculate_statistics_collection_vectorized(
+                    token_ids=token_ids, blocks=blocks, is_mint=is_mint)
+            else:
+                (collection_block_stats, token_block_dict) = StatisticsService.calculate_statistics_collection(
+                    transfers=transfers)
             (collection_cycle_stats, token_cycle_dict) = self.graph_service.calculate_token_graph_statistics(
                 transfers=transfers)
             if collection_block_stats is None or token_block_dict is None:
@@ -47,14 +97,290 @@ class StatisticsService:
                                                       cycle_stats=collection_cycle_stats,
                                                       block_stats=collection_block_stats)
 
-            for k, v in token_block_dict.items():
-                items = len(v)
-                token = Token(token_id=k, contract_address=collection.contract_address,
-                              cycle_count=token_cycle_dict[k], block_diff_average=v["stats"].avg,
-                              block_diff_std=v["stats"].std_deviation, transfer_count=items)
-                self.db.tokens.add_token(db_session=db_session, token=token)
+            # same condition as add_token, but existing tokens are updated and everything is written in one batch.
+            tokens = [{
+                "contract_address": collection.contract_address,
+                "token_id": k,
+                "cycle_count": token_cycle_dict[k],
+                "block_diff_average": v["stats"].avg,
+                "block_diff_std": v["stats"].std_deviation,
+                "transfer_count": v["stats"].total_count
+            } for k, v in token_block_dict.items() if v["stats"].avg > 0]
+            self.db.tokens.bulk_upsert_tokens(db_session=db_session, tokens=tokens)
+            self._invalidate_responses(collection.contract_address)
             print("done inserting tokens into db.")
 
+    '''
+    This method folds the transfers that have been scanned since the last update into the running aggregates of the 
+    collection (TokenAggregate/CollectionAggregate), and updates the block statistics of the changed tokens and of the 
+    collection from them. Only the new transfers are read, so the cost is O(new transfers) instead of a full recompute.
+    Cycle statistics are not touched. Returns the number of transfers that were folded in.
+    '''
+    def update_collection_stats_incremental(self, *, db_session: Session, collection: Collection,
+                                            min_nr_of_transfers: int = 3) -> int:
+        contract_address = collection.contract_address
+        collection_aggregate = self.db.collection_aggregates.get_or_create(db_session=db_session,
+                                                                           contract_address=contract_address)
+        token_aggregates = self.db.token_aggregates.get_aggregates_in_collection(db_session=db_session,
+                                                                                 contract_address=contract_address)
+
+        # a rescan or backfill that stores transfers at or below aggregated_block sets it back to -1 before it stores
+        # them (see CollectionAggregate.invalidate_from). The aggregates are then built again from the first transfer.
+        if collection_aggregate.aggregated_block < 0:
+            for aggregate in token_aggregates.values():
+                aggregate.reset()
+
+        rows = self.db.transfers.get_token_blocks_from_collection(db_session=db_session,
+                                                                  contract_address=contract_address,
+                                                                  after_block=collection_aggregate.aggregated_block)
+        if len(rows) == 0:
+            return 0
+
+        changed_tokens = set()
+        for (token_id, block, from_address) in rows:
+            aggregate = token_aggregates.get(token_id)
+            if aggregate is None:
+                aggregate = self.db.token_aggregates(contract_address=contract_address, token_id=token_id)
+                db_session.add(aggregate)
+                token_aggregates[token_id] = aggregate
+            # remove mint because it generally takes very short time
+            if from_address != MINT_ADDRESS:
+                aggregate.add_block(block)
+                changed_tokens.add(token_id)
+
+        collection_aggregate.aggregated_block = max(block for (_, block, _) in rows)
+        collection_aggregate.token_count = len(token_aggregates)
+
+        tokens = []
+        for token_id in changed_tokens:
+            aggregate = token_aggregates[token_id]
+            if aggregate.transfer_count <= min_nr_of_transfers:
+                continue
+            stats = aggregate.to_token_statistics()
+            if stats.avg > 0:
+                tokens.append({
+                    "contract_address": contract_address,
+                    "token_id": token_id,
+                    "block_diff_average": stats.avg,
+                    "block_diff_std": stats.std_deviation,
+                    "transfer_count": aggregate.transfer_count
+                })
+
+        collection_stats = StatisticsService.merge_token_aggregates(token_aggregates=token_aggregates,
+                                                                    min_nr_of_transfers=min_nr_of_transfers)
+        self.db.collections.set_collection_block_statistics(db_session=db_session, contract_address=contract_address,
+                                                            block_stats=collection_stats)
+        # commits the aggregates and the collection statistics together with the tokens.
+        if len(tokens) > 0:
+            self.db.tokens.bulk_upsert_tokens(db_session=db_session, tokens=tokens)
+        else:
+            db_session.commit()
+        self._invalidate_responses(contract_address)
+        return len(rows)
+
+    '''
+    database side version of the block statistics in insert_collections_stats. The block differences are calculated 
+    with window functions and summed per token (see Transfer.block_diff_summary), so only one row per token is sent to 
+    the app server instead of every transfer. The averages and standard deviations are derived from those sums in 
+    python, the same way as for the running aggregates of update_collection_stats_incremental, because many SQLite 
+    builds have no SQRT. Requires a database with window functions (MariaDB 10.2+, MySQL 8, PostgreSQL, SQLite 3.25+). 
+    Cycle statistics are not touched.
+    '''
+    def insert_collections_stats_sql(self, *, db_session: Session, collection: Collection, min_nr_of_transfers: int = 3):
+        contract_address = collection.contract_address
+        summary = self.db.transfers.block_diff_summary(contract_address=contract_address, mint_address=MINT_ADDRESS)
+        # not added to the session, they only carry the sums of the summary.
+        token_aggregates = {row.token_id: self.db.token_aggregates(
+            contract_address=contract_address, token_id=row.token_id, transfer_count=row.transfer_count,
+            diff_sum=int(row.diff_sum or 0), diff_sum_squares=int(row.diff_sum_squares or 0), min_diff=row.min_diff,
+            max_diff=row.max_diff, min_non_zero_diff=row.min_non_zero_diff)
+            for row in db_session.execute(select(summary)).all()}
+
+        # same conditions as add_token: only tokens with more than min_nr_of_transfers and an average above 0.
+        tokens = []
+        for (token_id, aggregate) in token_aggregates.items():
+            if aggregate.transfer_count <= min_nr_of_transfers:
+                continue
+            stats = aggregate.to_token_statistics()
+            if stats.avg > 0:
+                tokens.append({
+                    "contract_address": contract_address,
+                    "token_id": token_id,
+                    "block_diff_average": stats.avg,
+                    "block_diff_std": stats.std_deviation,
+                    "transfer_count": aggregate.transfer_count
+                })
+
+        collection_stats = StatisticsService.merge_token_aggregates(token_aggregates=token_aggregates,
+                                                                    min_nr_of_transfers=min_nr_of_transfers)
+        self.db.collections.set_collection_block_statistics(db_session=db_session, contract_address=contract_address,
+                                                            block_stats=collection_stats)
+        # commits the collection statistics together with the tokens.
+        if len(tokens) > 0:
+            self.db.tokens.bulk_upsert_tokens(db_session=db_session, tokens=tokens)
+        else:
+            db_session.commit()
+        self._invalidate_responses(contract_address)
+        return collection_stats
+
+    '''
+    database side version of populate_collection_stats, which only calculates the block statistics of every collection
+    with insert_collections_stats_sql.
+    '''
+    def populate_collection_stats_sql(self):
+        with self.db.start_session() as session:
+            collections = self.db.collections.get_all_collections(db_session=session)
+            for col in collections:
+                self.insert_collections_stats_sql(db_session=session, collection=col[0])
+
+    '''
+    function that combines the running aggregates of the tokens in a collection into the collection statistics, using 
+    the same formulas as calculate_statistics_collection.
+    '''
+    @staticmethod
+    def merge_token_aggregates(*, token_aggregates: dict, min_nr_of_transfers: int = 3) -> Statistics.CollectionStatistics:
+        collection_stats = collectionStats()
+        collection_stats.total_count = len(token_aggregates)
+        acc_valid, diff_sum, valid_tokens = 0, 0, 0
+
+        for k, aggregate in token_aggregates.items():
+            if aggregate.transfer_count <= min_nr_of_transfers:
+                continue
+            token_stats = aggregate.to_token_statistics()
+            valid_tokens += 1
+            collection_stats.count_valid += aggregate.transfer_count
+            acc_valid += aggregate.diff_sum
+            diff_sum += math.pow(token_stats.std_deviation, 2) * token_stats.total_count - 1
+            if aggregate.max_diff is not None and aggregate.max_diff > collection_stats.high[1]:
+                collection_stats.high = (k, aggregate.max_diff)
+            if aggregate.min_non_zero_diff is not None and aggregate.min_non_zero_diff < collection_stats.low[1]:
+                collection_stats.low = (k, aggregate.min_non_zero_diff)
+
+        if collection_stats.count_valid != 0 and acc_valid != 0:
+            collection_stats.avg = acc_valid / collection_stats.count_valid
+        if diff_sum != 0 and collection_stats.count_valid != 0:
+            collection_stats.std_deviation = math.sqrt(diff_sum / (collection_stats.count_valid - valid_tokens))
+        return collection_stats
+
+    '''
+    streaming version of insert_collections_stats. The transfers are read from a server-side cursor, ordered by token 
+    and block, and the block and cycle statistics of every token are calculated as soon as its transfers end. Peak memory
+    is therefore proportional to the history of the largest token plus one small row per token, instead of the whole
+    collection. The rows are only written once the cursor is exhausted, in a single transaction on db_session, so a 
+    failure leaves the previous statistics untouched and no second connection is needed while the cursor is open.
+    '''
+    def insert_collections_stats_streaming(self, *, db_session: Session, collection: Collection,
+                                           min_nr_of_transfers: int = 3, chunk_size: int = 10000):
+        contract_address = collection.contract_address
+        rows = self.db.transfers.stream_ordered_transfers_from_collection(db_session=db_session,
+                                                                          contract_address=contract_address,
+                                                                          chunk_size=chunk_size)
+        collection_stats = collectionStats()
+        cycle_counts = {}  # k = token_id, v = number of cycles. Needed for the cycle statistics of the collection.
+        acc_valid, std_diff_sum, valid_tokens = 0, 0, 0
+        tokens = []
+
+        for token_id, group in groupby(rows, key=lambda row: row.token_id):
+            transfers = list(group)
+            cycle_counts[token_id] = self.graph_service.count_token_cycles(transfers)
+            collection_stats.total_count += 1
+
+            # remove mint because it generally takes very short time
+            blocks = [t.block for t in transfers if t.from_address != MINT_ADDRESS]
+            if len(blocks) <= min_nr_of_transfers:
+                continue
+
+            token_stats = StatisticsService._calc_token_statistics(blocks=blocks)
+            for diff in token_stats.list_of_diffs:
+                StatisticsService._check_extremes_collection(stats_obj=collection_stats, val=diff, k=token_id)
+            collection_stats.count_valid += token_stats.total_count
+            acc_valid += sum(token_stats.list_of_diffs)
+            std_diff_sum += math.pow(token_stats.std_deviation, 2) * token_stats.total_count - 1
+            valid_tokens += 1
+
+            if token_stats.avg > 0:
+                tokens.append({
+                    "contract_address": contract_address,
+                    "token_id": token_id,
+                    "cycle_count": cycle_counts[token_id],
+                    "block_diff_average": token_stats.avg,
+                    "block_diff_std": token_stats.std_deviation,
+                    "transfer_count": token_stats.total_count
+                })
+
+        if collection_stats.total_count == 0:
+            return None
+
+        # same formulas as _calc_average_time_diff and _calc_standard_deviation_collection.
+        if collection_stats.count_valid != 0 and acc_valid != 0:
+            collection_stats.avg = acc_valid / collection_stats.count_valid
+        if std_diff_sum != 0 and collection_stats.count_valid != 0:
+            collection_stats.std_deviation = math.sqrt(std_diff_sum / (collection_stats.count_valid - valid_tokens))
+        cycle_stats = StatisticsService._calc_cycle_statistics(cycle_dict=cycle_counts)
+
+        # the cursor is exhausted, so the session can write. Committed together with the tokens.
+        self.db.collections.set_collection_block_statistics(db_session=db_session, contract_address=contract_address,
+                                                            block_stats=collection_stats)
+        self.db.collections.set_collection_cycle_statistics(db_session=db_session, contract_address=contract_address,
+                                                            cycle_stats=cycle_stats)
+        if len(tokens) > 0:
+            self.db.tokens.bulk_upsert_tokens(db_session=db_session, tokens=tokens)
+        else:
+            db_session.commit()
+        self._invalidate_responses(contract_address)
+        print("done inserting tokens into db.")
+        return collection_stats
+
+    # settings the worker processes of populate_collection_stats_parallel need to calculate the statistics like this
+    # service does. Spawned workers start from a fresh interpreter, so the database of this process is passed as a url.
+    def _worker_config(self) -> dict:
+        return {
+            "connection_string": get_engine().url.render_as_string(hide_password=False),
+            "vectorized": self.vectorized,
+            "streaming": self.streaming,
+            "cycle_counter": GraphService.GraphService.cycle_counter
+        }
+
+    def _invalidate_responses(self, contract_address: str):
+        if self.response_cache is not None:
+            self.response_cache.invalidate(contract_address)
+
+    '''
+    function that calculates the statistics of a single token from the blocks of its transfers, like 
+    _calc_average_time_diff does for every token in a dict.
+    '''
+    @staticmethod
+    def _calc_token_statistics(*, blocks: list) -> Statistics.TokenStatistics:
+        token_stats = tokenStats()
+        items = len(blocks)
+        diffs = [blocks[i + 1] - blocks[i] for i in range(items - 1)]
+        for diff in diffs:
+            StatisticsService._check_extremes_token(stats_obj=token_stats, val=diff)
+        token_stats.avg = sum(diffs) / items
+        token_stats.total_count = items
+        token_stats.list_of_diffs = diffs
+        StatisticsService._calc_standard_deviation_token(stats_obj=token_stats)
+        return token_stats
+
+    '''
+    function that calculates the cycle statistics of a collection from the number of cycles of every token, using the 
+    same formulas as GraphService.calculate_token_graph_statistics.
+    '''
+    @staticmethod
+    def _calc_cycle_statistics(*, cycle_dict: dict) -> Statistics.TokenCycleStatistic:
+        cycle_stats = Statistics.TokenCycleStatistic()
+        cycles_acc = sum(cycle_dict.values())
+        tokens_count = len(cycle_dict)
+        if cycles_acc != 0 and tokens_count != 0:
+            cycle_stats.avg = cycles_acc / tokens_count
+            diff_sum = 0
+            for number_of_cycles in cycle_dict.values():
+                if number_of_cycles > 0:
+                    diff_sum += math.pow(number_of_cycles - cycle_stats.avg, 2)
+            cycle_stats.std_deviation = math.sqrt(diff_sum / tokens_count)
+            cycle_stats.total_count = tokens_count
+        return cycle_stats
+
     '''
     This function calculates the statistics for a given token in a collection and prints the results.
     '''
@@ -117,6 +443,112 @@ class StatisticsService:
         # return stats of collection and the dict containing stats object for each token
         return collection_stats, valid_tk_dict
 
+    '''
+    function that turns rows from get_ordered_transfers_from_collection into the arrays used by 
+    calculate_statistics_collection_vectorized.
+    '''
+    @staticmethod
+    def transfers_to_arrays(*, transfers) -> (np.ndarray, np.ndarray, np.ndarray):
+        count = len(transfers)
+        token_ids = np.fromiter((row[0].token_id for row in transfers), dtype=np.int64, count=count)
+        blocks = np.fromiter((row[0].block for row in transfers), dtype=np.int64, count=count)
+        is_mint = np.fromiter((row[0].from_address == MINT_ADDRESS for row in transfers), dtype=bool, count=count)
+        return token_ids, blocks, is_mint
+
+    '''
+    numpy version of calculate_statistics_collection. Takes the token id, block and "is a mint" flag of every transfer as
+    arrays, which must be ordered by token id and then by block like get_ordered_transfers_from_collection. All 
+    per-token diffs, averages, standard deviations and extremes are calculated with grouped array operations, and the 
+    result has the same shape and values as calculate_statistics_collection, except for rounding in the last digits of 
+    the standard deviations, since numpy sums in a different order.
+    '''
+    @staticmethod
+    def calculate_statistics_collection_vectorized(*, token_ids, blocks, is_mint=None,
+                                                   min_nr_of_transfers: int = 3) -> (Statistics.CollectionStatistics, dict):
+        collection_stats = collectionStats()
+        token_ids = np.asarray(token_ids, dtype=np.int64)
+        blocks = np.asarray(blocks, dtype=np.int64)
+        if len(token_ids) == 0:
+            return collection_stats, {}
+
+        # tokens that have only been minted still count towards total_count.
+        collection_stats.total_count = int(np.count_nonzero(np.diff(token_ids)) + 1)
+
+        # remove mint because it generally takes very short time
+        if is_mint is not None:
+            keep = ~np.asarray(is_mint, dtype=bool)
+            token_ids, blocks = token_ids[keep], blocks[keep]
+        if len(token_ids) == 0:
+            return collection_stats, {}
+
+        # split the transfers into one group per token.
+        starts = np.flatnonzero(np.r_[True, token_ids[1:] != token_ids[:-1]])
+        counts = np.diff(np.r_[starts, len(token_ids)])
+        valid = counts > min_nr_of_transfers  # sort out the token that have only been minted and nothing else
+        if not valid.any():
+            return collection_stats, {}
+
+        # diffs[i] is the difference between transfer i and i + 1. Only keep diffs inside the groups of valid tokens.
+        group_of_transfer = np.repeat(np.arange(len(starts)), counts)
+        diffs = np.diff(blocks)
+        keep_diff = (token_ids[1:] == token_ids[:-1]) & valid[group_of_transfer[:-1]]
+        valid_diffs = diffs[keep_diff]
+        valid_diff_tokens = token_ids[1:][keep_diff]
+
+        valid_starts, valid_counts = starts[valid], counts[valid]
+        diff_counts = valid_counts - 1
+        diff_starts = np.r_[0, np.cumsum(diff_counts)[:-1]]
+
+        sums = np.add.reduceat(valid_diffs, diff_starts)
+        averages = sums / valid_counts  # the original divides by the number of transfers, not the number of diffs
+        deviations = valid_diffs - np.repeat(averages, diff_counts)
+        squared_sums = np.add.reduceat(deviations * deviations, diff_starts)
+        std_deviations = np.sqrt(squared_sums / diff_counts)
+        fastest = np.minimum.reduceat(valid_diffs, diff_starts)
+        # diffs are never negative, so -1 marks tokens where every diff is 0.
+        slowest = np.maximum.reduceat(np.where(valid_diffs != 0, valid_diffs, -1), diff_starts)
+
+        token_dict = {}
+        for i, (token_id, start, count, diff_start) in enumerate(zip(token_ids[valid_starts].tolist(),
+                                                                     valid_starts.tolist(), valid_counts.tolist(),
+                                                                     diff_starts.tolist())):
+            token_stats = tokenStats()
+            token_stats.avg = float(averages[i])
+            token_stats.total_count = count
+            token_stats.list_of_diffs = valid_diffs[diff_start:diff_start + count - 1].tolist()
+            if squared_sums[i] != 0:
+                token_stats.std_deviation = float(std_deviations[i])
+            token_stats.fastest = int(fastest[i])
+            if slowest[i] != -1:
+                token_stats.slowest = int(slowest[i])
+            token_dict[token_id] = {
+                "blocks": blocks[start:start + count].tolist(),
+                "stats": token_stats
+            }
+
+        collection_stats.count_valid = int(valid_counts.sum())
+        collection_stats.list_of_diffs = valid_diffs.tolist()
+        acc_valid = int(sums.sum())
+        if collection_stats.count_valid != 0 and acc_valid != 0:
+            collection_stats.avg = acc_valid / collection_stats.count_valid
+
+        # argmax/argmin return the first occurrence, which is the one the python loop keeps.
+        highest = int(np.argmax(valid_diffs))
+        collection_stats.high = (int(valid_diff_tokens[highest]), int(valid_diffs[highest]))
+        non_zero = np.flatnonzero(valid_diffs)
+        if len(non_zero) > 0:
+            lowest = non_zero[np.argmin(valid_diffs[non_zero])]
+            collection_stats.low = (int(valid_diff_tokens[lowest]), int(valid_diffs[lowest]))
+
+        # same formula as _calc_standard_deviation_collection, including the "- 1" applied to every token.
+        token_std_deviations = np.array([v['stats'].std_deviation for v in token_dict.values()], dtype=float)
+        diff_sum = float(np.sum(token_std_deviations ** 2 * valid_counts - 1))
+        n_sum = collection_stats.count_valid
+        if diff_sum != 0 and n_sum != 0:
+            collection_stats.std_deviation = math.sqrt(diff_sum / (n_sum - len(token_dict)))
+
+        return collection_stats, token_dict
+
     '''
     function that calculates the standard deviation for a given statistics object given that it has a list_of_diffs.
     https://www.cuemath.com/data/standard-deviation/
@@ -216,3 +648,29 @@ class StatisticsService:
             stats_obj.fastest = val
         if val > stats_obj.slowest and val != 0:
             stats_obj.slowest = val
+
+
+# the statistics service of a worker process in populate_collection_stats_parallel.
+_worker_statistics_service = None
+
+
+def _init_statistics_worker(config: dict):
+    global _worker_statistics_service
+    # read by get_engine when the first session is started.
+    os.environ["connection_string"] = config["connection_string"]
+    GraphService.GraphService.cycle_counter = config["cycle_counter"]
+    db = DatabaseModel.DatabaseModel()
+    _worker_statistics_service = StatisticsService(graph_service=GraphService.GraphService(db=db), db=db,
+                                                   vectorized=config["vectorized"], streaming=config["streaming"])
+
+
+def _insert_collection_stats_worker(contract_address: str):
+    start = time.time()
+    service = _worker_statistics_service
+    try:
+        with service.db.start_session() as session:
+            collection = service.db.collections.get_collection(db_session=session, contract_address=contract_address)
+            service.insert_collections_stats(db_session=session, collection=collection)
+        return contract_address, time.time() - start, None
+    except Exception as e:
+        return contract_address, time.time() - start, str(e)
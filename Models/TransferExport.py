@@ -0,0 +1,54 @@
+import csv
+import io
+
+from Models.GraphExport import GraphExport
+
+COLUMNS = ["contract_address", "tx", "log_index", "block", "token_id", "from_address", "to_address"]
+
+
+'''
+Writes the transfers of a collection as NDJSON (one json object per line) or CSV. The rows come in partitions from
+Transfer.stream_transfers_from_collection and every partition is encoded into one chunk, so an export of millions of
+transfers needs memory for a single partition and the first bytes are sent right away.
+The status code is sent before the first row, so an export that fails halfway ends with error_line instead, which
+clients check for to detect an incomplete export.
+'''
+class TransferExport:
+
+    formats = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+    @staticmethod
+    def iter_ndjson(partitions):
+        for rows in partitions:
+            yield b"".join(GraphExport.dumps(dict(zip(COLUMNS, row))) + b"\n" for row in rows)
+
+    @staticmethod
+    def iter_csv(partitions):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(COLUMNS)
+        yield buffer.getvalue().encode()
+        for rows in partitions:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(rows)
+            yield buffer.getvalue().encode()
+
+    '''
+    last line of an export that stopped because of an error: {"error": ...} for NDJSON and a row starting with #error
+    for CSV.
+    '''
+    @staticmethod
+    def error_line(export_format: str, error: Exception) -> bytes:
+        message = f"export incomplete: {type(error).__name__}"
+        if export_format == "csv":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerow(["#error", message])
+            return buffer.getvalue().encode()
+        return GraphExport.dumps({"error": message}) + b"\n"
+
+    @staticmethod
+    def iter_export(partitions, export_format: str):
+        if export_format == "csv":
+            return TransferExport.iter_csv(partitions)
+        return TransferExport.iter_ndjson(partitions)
@@ -0,0 +1,353 @@
+import numpy as np
+import networkx as nx
+from typing import Tuple
+
+from Models.CycleCounter import CycleCounter
+
+MINT_ADDRESS = "0000000000000000000000000000000000000000"
+
+
+'''
+Maps addresses (or transaction hashes) to consecutive integer ids and back. One index is shared by all tokens of a
+collection, so every address is stored once.
+'''
+class AddressIndex:
+
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def intern(self, value) -> int:
+        i = self.ids.get(value)
+        if i is None:
+            i = len(self.values)
+            self.ids[value] = i
+            self.values.append(value)
+        return i
+
+    def copy(self):
+        index = AddressIndex()
+        index.ids = dict(self.ids)
+        index.values = list(self.values)
+        return index
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+
+'''
+Compact transfer graph of a collection. Instead of one networkx MultiDiGraph per token with string nodes, the addresses
+are interned once and the transfers are stored as parallel numpy arrays (token, src, dst, block, tx), sorted by token
+and block. The edges of a token are the slice token_offsets[i]:token_offsets[i + 1], and out_csr() gives the CSR
+adjacency of the whole collection.
+Mint transfers are kept in the arrays, but they only add their receiver as a node when include_mint is False.
+The algorithms run on the arrays. networkx is only needed for to_networkx, which is used for the json export.
+'''
+class TransferGraph:
+
+    def __init__(self, *, addresses: AddressIndex, txs: AddressIndex, token, src, dst, block, tx):
+        self.addresses = addresses
+        self.txs = txs
+        order = np.lexsort((block, token))
+        self.token = token[order]
+        self.src = src[order]
+        self.dst = dst[order]
+        self.block = block[order]
+        self.tx = tx[order]
+        self.mint_id = addresses.ids.get(MINT_ADDRESS, -1)
+
+        (self.token_ids, starts) = np.unique(self.token, return_index=True)
+        self.token_offsets = np.append(starts, len(self.token))
+        self._token_position = {int(t): i for i, t in enumerate(self.token_ids)}
+        self.last_block = int(self.block.max()) if len(self.block) > 0 else -1
+        # derived structures of the wallet queries, built on first use.
+        self._undirected_csr = None
+        self._components = None
+
+    '''
+    builds the graph from transfer rows with from_address, to_address, block and tx. Rows without a token_id, like
+    the ones of DatabaseModel.get_token_transfers, are put under token_id.
+    '''
+    @staticmethod
+    def from_transfers(transfers, *, token_id: int = 0):
+        return TransferGraph._build(transfers, addresses=AddressIndex(), txs=AddressIndex(), token_id=token_id)
+
+    @staticmethod
+    def _build(transfers, *, addresses: AddressIndex, txs: AddressIndex, token_id: int = 0, previous=None):
+        count = len(transfers)
+        token = np.empty(count, dtype=np.int64)
+        src = np.empty(count, dtype=np.int32)
+        dst = np.empty(count, dtype=np.int32)
+        block = np.empty(count, dtype=np.int64)
+        tx = np.empty(count, dtype=np.int32)
+        for i, transfer in enumerate(transfers):
+            token[i] = getattr(transfer, "token_id", token_id)
+            src[i] = addresses.intern(transfer.from_address)
+            dst[i] = addresses.intern(transfer.to_address)
+            block[i] = transfer.block
+            tx[i] = txs.intern(transfer.tx)
+        if previous is not None:
+            (token, src, dst, block, tx) = (np.concatenate((previous.token, token)), np.concatenate((previous.src, src)),
+                                            np.concatenate((previous.dst, dst)),
+                                            np.concatenate((previous.block, block)), np.concatenate((previous.tx, tx)))
+        return TransferGraph(addresses=addresses, txs=txs, token=token, src=src, dst=dst, block=block, tx=tx)
+
+    '''
+    returns a new graph with the transfers appended. The new graph interns the new addresses into a copy of the address
+    index, because this graph can still be in use by other threads. Used to update a cached graph with the transfers the
+    scanner added after last_block.
+    '''
+    def extend(self, transfers):
+        if len(transfers) == 0:
+            return self
+        return TransferGraph._build(transfers, addresses=self.addresses.copy(), txs=self.txs.copy(), previous=self)
+
+    def save(self, path: str):
+        np.savez_compressed(path, token=self.token, src=self.src, dst=self.dst, block=self.block, tx=self.tx,
+                            addresses=np.array(self.addresses.values, dtype=str),
+                            txs=np.array(self.txs.values, dtype=str))
+
+    @staticmethod
+    def load(path: str):
+        with np.load(path) as data:
+            addresses = AddressIndex()
+            for address in data["addresses"].tolist():
+                addresses.intern(address)
+            txs = AddressIndex()
+            for tx in data["txs"].tolist():
+                txs.intern(tx)
+            return TransferGraph(addresses=addresses, txs=txs, token=data["token"], src=data["src"], dst=data["dst"],
+                                 block=data["block"], tx=data["tx"])
+
+    # last_block of a saved graph, which only reads the blocks from the file.
+    @staticmethod
+    def load_last_block(path: str) -> int:
+        with np.load(path) as data:
+            block = data["block"]
+            return int(block.max()) if len(block) > 0 else -1
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.src)
+
+    def tokens(self) -> list:
+        return [int(t) for t in self.token_ids]
+
+    def _token_slice(self, token_id) -> slice:
+        i = self._token_position.get(token_id)
+        if i is None:
+            return slice(0, 0)
+        return slice(self.token_offsets[i], self.token_offsets[i + 1])
+
+    '''
+    returns the (src, dst) arrays of the edges of a token, or of the whole collection when token_id is None.
+    '''
+    def edges(self, token_id: int = None, *, include_mint: bool = False):
+        s = self._token_slice(token_id) if token_id is not None else slice(None)
+        (src, dst) = (self.src[s], self.dst[s])
+        if not include_mint:
+            keep = src != self.mint_id
+            (src, dst) = (src[keep], dst[keep])
+        return src, dst
+
+    '''
+    returns the nodes of a token like create_token_graph would add them: every sender and receiver, except the mint
+    address when include_mint is False.
+    '''
+    def nodes(self, token_id: int = None, *, include_mint: bool = False):
+        s = self._token_slice(token_id) if token_id is not None else slice(None)
+        # sender and receiver of every transfer in turn, so the nodes keep the order in which they first appear.
+        endpoints = np.column_stack((self.src[s], self.dst[s])).ravel()
+        (_, first) = np.unique(endpoints, return_index=True)
+        nodes = endpoints[np.sort(first)]
+        if not include_mint:
+            nodes = nodes[nodes != self.mint_id]
+        return nodes
+
+    '''
+    CSR adjacency of the collection: the receivers of node i are indices[indptr[i]:indptr[i + 1]].
+    '''
+    def out_csr(self, *, include_mint: bool = False):
+        (src, dst) = self.edges(include_mint=include_mint)
+        order = np.argsort(src, kind="stable")
+        indptr = np.zeros(len(self.addresses) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=len(self.addresses)), out=indptr[1:])
+        return indptr, dst[order]
+
+    '''
+    adjacency sets of a token with local node ids, plus the number of distinct self-loops. This is the input of
+    CycleCounter.count.
+    '''
+    def token_adjacency(self, token_id: int):
+        (src, dst) = self.edges(token_id)
+        (nodes, local) = np.unique(np.concatenate((src, dst)), return_inverse=True)
+        local_src = local[:len(src)]
+        local_dst = local[len(src):]
+        adjacency = [set() for _ in range(len(nodes))]
+        self_loops = set()
+        for (u, v) in zip(local_src.tolist(), local_dst.tolist()):
+            if u == v:
+                self_loops.add(u)
+            else:
+                adjacency[u].add(v)
+        return adjacency, len(self_loops)
+
+    '''
+    returns the id of an address, or None if it never sent or received a token of the collection. Addresses are stored
+    like in the transfers table, lower case without 0x.
+    '''
+    def node_id(self, address: str):
+        address = address.lower()
+        if address.startswith("0x") and len(address) == 42:
+            address = address[2:]
+        return self.addresses.ids.get(address)
+
+    def _undirected(self):
+        # CSR over both directions of every edge, without the mint address.
+        if self._undirected_csr is None:
+            (src, dst) = self.edges()
+            (a, b) = (np.concatenate((src, dst)), np.concatenate((dst, src)))
+            order = np.argsort(a, kind="stable")
+            indptr = np.zeros(len(self.addresses) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(a, minlength=len(self.addresses)), out=indptr[1:])
+            self._undirected_csr = (indptr, b[order])
+        return self._undirected_csr
+
+    '''
+    number of transfers a wallet sent and received, and the number of distinct wallets it traded with.
+    '''
+    def degree(self, address: str) -> dict:
+        i = self.node_id(address)
+        if i is None:
+            return {"out": 0, "in": 0, "counterparties": 0}
+        (src, dst) = self.edges()
+        (indptr, neighbours) = self._undirected()
+        counterparties = np.unique(neighbours[indptr[i]:indptr[i + 1]])
+        return {
+            "out": int(np.count_nonzero(src == i)),
+            "in": int(np.count_nonzero(dst == i)),
+            "counterparties": int(np.count_nonzero(counterparties != i))
+        }
+
+    '''
+    the n wallets a wallet traded with most, as dicts with the number of transfers in both directions.
+    '''
+    def top_counterparties(self, address: str, n: int = 10) -> list:
+        i = self.node_id(address)
+        if i is None:
+            return []
+        (src, dst) = self.edges()
+        sent = np.bincount(dst[src == i], minlength=len(self.addresses))
+        received = np.bincount(src[dst == i], minlength=len(self.addresses))
+        total = sent + received
+        total[i] = 0
+        top = np.argsort(-total, kind="stable")[:n]
+        return [{"address": self.addresses[j], "sent": int(sent[j]), "received": int(received[j])}
+                for j in top.tolist() if total[j] > 0]
+
+    '''
+    weakly connected components of the wallets, ignoring mints. Returns an array with the component label of every 
+    node. Isolated wallets, that only received a mint, get their own label.
+    '''
+    def connected_components(self):
+        if self._components is None:
+            parent = np.arange(len(self.addresses))
+
+            def find(x):
+                while parent[x] != x:
+                    parent[x] = parent[parent[x]]
+                    x = parent[x]
+                return x
+
+            (src, dst) = self.edges()
+            for (u, v) in zip(src.tolist(), dst.tolist()):
+                (ru, rv) = (find(u), find(v))
+                if ru != rv:
+                    parent[max(ru, rv)] = min(ru, rv)
+            self._components = np.array([find(x) for x in range(len(parent))], dtype=np.int64)
+        return self._components
+
+    '''
+    sizes of the connected components with more than one wallet, largest first.
+    '''
+    def component_sizes(self) -> list:
+        labels = self.connected_components()
+        if self.mint_id >= 0:
+            labels = np.delete(labels, self.mint_id)
+        sizes = np.bincount(labels) if len(labels) > 0 else np.array([], dtype=np.int64)
+        return sorted((int(size) for size in sizes if size > 1), reverse=True)
+
+    def component_of(self, address: str) -> list:
+        i = self.node_id(address)
+        if i is None:
+            return []
+        labels = self.connected_components()
+        return [self.addresses[j] for j in np.flatnonzero(labels == labels[i]).tolist() if j != self.mint_id]
+
+    '''
+    wallets within k transfers of a wallet, in either direction, as a dict of address -> distance.
+    '''
+    '''
+    returns the wallets within k hops of a wallet with their distance, and whether the search was cut off. A few hops
+    around a marketplace or a busy wallet can cover most of the collection, so the search stops once it found max_nodes
+    wallets or read max_edges edges.
+    '''
+    def k_hop_neighborhood(self, address: str, k: int = 2, *, max_nodes: int = 10000,
+                           max_edges: int = 1000000) -> Tuple[dict, bool]:
+        i = self.node_id(address)
+        if i is None:
+            return {}, False
+        (indptr, neighbours) = self._undirected()
+        distance = {i: 0}
+        frontier = [i]
+        edges = 0
+        truncated = False
+        for hop in range(1, k + 1):
+            next_frontier = []
+            for node in frontier:
+                edges += int(indptr[node + 1] - indptr[node])
+                if edges > max_edges:
+                    truncated = True
+                    break
+                for neighbour in np.unique(neighbours[indptr[node]:indptr[node + 1]]).tolist():
+                    if neighbour not in distance:
+                        if len(distance) >= max_nodes:
+                            truncated = True
+                            break
+                        distance[neighbour] = hop
+                        next_frontier.append(neighbour)
+                if truncated:
+                    break
+            if truncated:
+                break
+            frontier = next_frontier
+        return {self.addresses[j]: d for j, d in distance.items()}, truncated
+
+    def count_cycles(self, counter: CycleCounter) -> dict:
+        cycles = {}
+        for token_id in self.tokens():
+            (adjacency, self_loops) = self.token_adjacency(token_id)
+            cycles[token_id] = counter.count(adjacency, self_loops=self_loops)
+        return cycles
+
+    def strongly_connected_component_sizes(self, token_id: int) -> list:
+        (adjacency, _) = self.token_adjacency(token_id)
+        return sorted((len(c) for c in CycleCounter.strongly_connected_components(adjacency)), reverse=True)
+
+    '''
+    converts a token, or the whole collection when token_id is None, into a networkx MultiDiGraph with the addresses
+    as nodes and block and tx as edge attributes.
+    '''
+    def to_networkx(self, token_id: int = None, *, include_mint: bool = False):
+        s = self._token_slice(token_id) if token_id is not None else slice(None)
+        g = nx.MultiDiGraph()
+        for i in self.nodes(token_id, include_mint=include_mint).tolist():
+            g.add_node(self.addresses[i])
+        for (u, v, block, tx) in zip(self.src[s].tolist(), self.dst[s].tolist(), self.block[s].tolist(),
+                                     self.tx[s].tolist()):
+            if include_mint or u != self.mint_id:
+                g.add_edge(self.addresses[u], self.addresses[v], block=block, tx=self.txs[tx])
+        return g
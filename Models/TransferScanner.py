@@ -1,13 +1,19 @@
 import json
 import time
 import os
+import threading
+import queue
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 from tqdm import tqdm
 from web3 import Web3
 from typing import Tuple
 from colorama import Fore, Style
-from Models import CONTRACT_NAME_ABI, EVENT_SIGNATURE_HASH, CollectionService, Session, StatisticsService
+from Models import CONTRACT_NAME_ABI, EVENT_SIGNATURE_HASH, CollectionService, Session, StatisticsService, \
+    ChunkSizeController
 from Models import DatabaseModel as dbm
 from Entities import Slug
 from rich.traceback import install
@@ -27,9 +33,27 @@ class TransferScanner:
                  log_mode: bool = False,
                  export_type: str = "db",
                  collection_service: CollectionService.CollectionService = None,
-                 statistics_service: StatisticsService.StatisticsService = None):
+                 statistics_service: StatisticsService.StatisticsService = None,
+                 http_session: requests.Session = None,
+                 response_cache=None,
+                 wallet_graphs=None):
         self.statistics_service = statistics_service
-        self.w3 = Web3(Web3.HTTPProvider(provider_url))
+        # cache of the api responses, invalidated for a collection when a scan of it finishes.
+        self.response_cache = response_cache
+        # WalletGraphCache of the api. Graphs the scan stored older transfers for are removed when a scan finishes.
+        self.wallet_graphs = wallet_graphs
+        self.provider_url = provider_url
+        # session shared by web3 and the JSON-RPC batch requests, which web3 does not support. Passing a session with a
+        # larger connection pool lets parallel scans reuse their connections.
+        self.http = http_session if http_session is not None else requests.Session()
+        # seconds to wait for the node before a request fails.
+        self.request_timeout = 60
+        # a rate limited request is sent again after rate_limit_backoff seconds, doubled after every further refusal,
+        # up to rate_limit_retries times.
+        self.rate_limit_retries = 5
+        self.rate_limit_backoff = 1.0
+        self.w3 = Web3(Web3.HTTPProvider(provider_url, session=self.http,
+                                         request_kwargs={"timeout": self.request_timeout}))
         self.log_mode = log_mode
         self.export_type = export_type
         self.collection_service = collection_service
@@ -40,6 +64,28 @@ class TransferScanner:
         self.chunk_size_increase = 2.0
         self.chunk_size_decrease = 0.5
 
+        # settings for the ChunkSizeController that every scan uses to pick its chunk sizes. The controllers of the
+        # latest scan of a thread are kept in chunk_controllers, so their decisions can be inspected with chunk_metrics.
+        # Every scan fills a list of its own, so scans running at the same time on a shared scanner do not mix their
+        # controllers.
+        self.target_events_per_request = 5000
+        self.latency_budget = 10.0
+        self._local = threading.local()
+
+        # used by scan_parallel. The block range is split into shards of this size, which are scanned independently.
+        self.shard_size = 100000
+
+        # how scan_with_progressbar scans when the caller does not say: with more than one worker scan_parallel is
+        # used, otherwise scan_pipelined if pipelined is set and scan if not.
+        self.workers = 1
+        self.pipelined = False
+
+        # "logs" fetches each range with a single stateless eth_getLogs call. "filter" installs a filter with
+        # eth_newFilter and reads it with eth_getFilterLogs, which costs two calls per range.
+        self.fetch_mode = "logs"
+        # number of consecutive ranges that scan_parallel sends to the node in one JSON-RPC batch request.
+        self.batch_size = 4
+
         self.db = db
         # Transfer event signature hash
         self.event_signature_hash = EVENT_SIGNATURE_HASH
@@ -57,6 +103,141 @@ class TransferScanner:
             "topics": event_signature_hash
         })
 
+    def get_logs_params(self, from_block: int, to_block: int, contract_address: str) -> dict:
+        return {
+            "fromBlock": from_block,
+            "toBlock": to_block,
+            "address": contract_address,
+            "topics": self.event_signature_hash
+        }
+
+    # fetches the raw transfer logs of a contract in the (inclusive) block range [from_block, to_block].
+    # checksum_contract_address can also be a list of addresses, in which case the logs of all of them are fetched.
+    # raises a ValueError if the node refuses the range, e.g. because it contains more than 10000 events, see
+    # is_range_refused. Rate limited requests are retried.
+    def fetch_logs(self, from_block: int, to_block: int, checksum_contract_address: str) -> list:
+        return self._retry_rate_limited(lambda: self._fetch_logs(from_block, to_block, checksum_contract_address))
+
+    def _fetch_logs(self, from_block: int, to_block: int, checksum_contract_address: str) -> list:
+        if self.fetch_mode == "filter":
+            signature_filter = self.get_filter(from_block, to_block - from_block,
+                                               checksum_contract_address,
+                                               self.event_signature_hash)
+            try:
+                transfers_raw = self.w3.eth.get_filter_logs(signature_filter.filter_id)
+            finally:
+                # filters are kept by the node until they are uninstalled or time out.
+                self.w3.eth.uninstall_filter(signature_filter.filter_id)
+        else:
+            transfers_raw = self.w3.eth.get_logs(self.get_logs_params(from_block, to_block, checksum_contract_address))
+        return transfers_raw
+
+    # returns the message and code of a JSON-RPC error, which web3 raises as the first argument of a ValueError.
+    @staticmethod
+    def _rpc_error(error) -> Tuple[str, int]:
+        if isinstance(error, Exception) and len(error.args) > 0 and isinstance(error.args[0], dict):
+            error = error.args[0]
+        if isinstance(error, dict):
+            return str(error.get("message", "")).lower(), error.get("code")
+        if isinstance(error, requests.HTTPError) and error.response is not None:
+            return str(error).lower(), error.response.status_code
+        return str(error).lower(), None
+
+    '''
+    returns whether a JSON-RPC error means the node refused the block range because it holds too many logs, in which
+    case the range should be fetched again in smaller chunks. Nodes word this differently, e.g. "query returned more
+    than 10000 results" or "Log response size exceeded". The code does not tell, Infura uses -32005 for rate limiting
+    as well.
+    '''
+    @staticmethod
+    def is_range_refused(error) -> bool:
+        (message, _) = TransferScanner._rpc_error(error)
+        return any(m in message for m in ("query returned more than", "too many results", "response size exceeded",
+                                          "block range", "range is too large", "range too large"))
+
+    '''
+    returns whether an error means the node rate limits us, e.g. "daily request count exceeded, request rate limited" or
+    HTTP 429. Such a request has to be sent again later, splitting it would only send more requests.
+    '''
+    @staticmethod
+    def is_rate_limited(error) -> bool:
+        (message, code) = TransferScanner._rpc_error(error)
+        return code == 429 or any(m in message for m in ("rate limit", "request count exceeded", "too many requests",
+                                                          "rate exceeded", "capacity"))
+
+    # calls fetch until it is not rate limited, waiting longer after every refusal. Raises the last error when the
+    # retries are used up.
+    def _retry_rate_limited(self, fetch):
+        backoff = self.rate_limit_backoff
+        for attempt in range(self.rate_limit_retries + 1):
+            try:
+                return fetch()
+            except (ValueError, requests.HTTPError) as e:
+                if not self.is_rate_limited(e) or attempt == self.rate_limit_retries:
+                    raise
+                print(f"rate limited, retrying in {backoff} seconds: {e}")
+                time.sleep(backoff)
+                backoff = min(2 * backoff, 60.0)
+
+    # same as fetch_logs, but decodes the logs into transfer rows.
+    def fetch_transfers(self, from_block: int, to_block: int, checksum_contract_address: str) -> list:
+        return self.decode_logs(self.fetch_logs(from_block, to_block, checksum_contract_address))
+
+    '''
+    fetches several block ranges with one JSON-RPC batch request containing an eth_getLogs call per range. Returns a list
+    with the decoded transfers of each range, in the same order as ranges. The list ends with None at the first range
+    the node refused, so the caller can retry from there with a smaller chunk size. A rate limited batch is sent again,
+    any other error is raised as a ValueError.
+    '''
+    def fetch_transfers_batch(self, ranges: list, checksum_contract_address: str) -> list:
+        if self.fetch_mode == "filter" or len(ranges) == 1:
+            results = []
+            for (from_block, to_block) in ranges:
+                try:
+                    results.append(self.fetch_transfers(from_block, to_block, checksum_contract_address))
+                except ValueError as e:
+                    if not self.is_range_refused(e):
+                        raise
+                    print(e)
+                    results.append(None)
+                    # the ranges after a refused one are fetched again by the caller anyway.
+                    break
+            return results
+
+        return self._retry_rate_limited(lambda: self._fetch_transfers_batch(ranges, checksum_contract_address))
+
+    def _fetch_transfers_batch(self, ranges: list, checksum_contract_address: str) -> list:
+        payload = [{
+            "jsonrpc": "2.0",
+            "id": i,
+            "method": "eth_getLogs",
+            "params": [self.get_logs_params(hex(from_block), hex(to_block), checksum_contract_address)]
+        } for i, (from_block, to_block) in enumerate(ranges)]
+
+        response = self.http.post(self.provider_url, json=payload, timeout=self.request_timeout)
+        response.raise_for_status()
+        body = response.json()
+        # an error of the batch as a whole, e.g. rate limiting, is a single object instead of a list.
+        if isinstance(body, dict):
+            raise ValueError(body.get("error", body))
+        # the node is free to answer a batch in any order.
+        responses = {r.get("id"): r for r in body}
+
+        results = []
+        for i in range(len(ranges)):
+            r = responses.get(i)
+            if r is None:
+                raise ValueError(f"no response for range {ranges[i]}")
+            if "error" in r:
+                # the whole batch is sent again, also the ranges that were answered.
+                if self.is_rate_limited(r["error"]) or not self.is_range_refused(r["error"]):
+                    raise ValueError(r["error"])
+                print(r["error"])
+                results.append(None)
+                break
+            results.append(self.decode_logs(r["result"]))
+        return results
+
     def set_export_type(self, export_type):
         self.export_type = export_type
 
@@ -74,10 +255,33 @@ class TransferScanner:
 
         return int(chunk_size)
 
+    # creates the chunk size controller for a single scan, or for a single shard of a parallel scan, and adds it to the
+    # controllers of that scan.
+    def new_chunk_controller(self, controllers: list) -> ChunkSizeController.ChunkSizeController:
+        controller = ChunkSizeController.ChunkSizeController(min_chunk_size=self.min_chunk_size,
+                                                             max_chunk_size=self.max_chunk_size,
+                                                             target_events=self.target_events_per_request,
+                                                             latency_budget=self.latency_budget)
+        controllers.append(controller)
+        return controller
+
+    @property
+    def chunk_controllers(self) -> list:
+        return getattr(self._local, "chunk_controllers", [])
+
+    @chunk_controllers.setter
+    def chunk_controllers(self, controllers: list):
+        self._local.chunk_controllers = controllers
+
+    # metrics of the chunk size decisions made during the latest scan of the calling thread.
+    def chunk_metrics(self) -> dict:
+        return ChunkSizeController.ChunkSizeController.merge_metrics(self.chunk_controllers)
+
     def determine_start_block(self, db_session: Session, contract_address: str):
         (collection_exists, coll) = self.db.collections.collection_exists(db_session=db_session, contract_address=contract_address)
         if collection_exists:
-            start_block = coll.latest_block
+            # latest_block is only set once the first chunk with transfers has been stored.
+            start_block = coll.latest_block if coll.latest_block is not None else coll.start_block
         else:
             response = self.collection_service.get_start_block_and_slug(contract_address=contract_address)
             start_block = response.start_block
@@ -86,6 +290,48 @@ class TransferScanner:
                 self.db.slugs.add_slug_to_db(db_session=db_session, slug=sl)
         return start_block
 
+    # logs fetched through web3 contain HexBytes and ints, while logs from a raw JSON-RPC response only contain hex strings.
+    @staticmethod
+    def _to_hex(value) -> str:
+        if isinstance(value, str):
+            return value
+        value = value.hex()
+        return value if value.startswith('0x') else '0x' + value
+
+    @staticmethod
+    def _to_int(value) -> int:
+        return int(value, 16) if isinstance(value, str) else value
+
+    '''
+    decodes logs straight into transfer rows that can be passed to Transfer.bulk_add_transfer_list_to_db. Works on the 
+    AttributeDicts returned by web3 as well as on the dicts of a raw JSON-RPC response, so the logs never have to be 
+    re-encoded as json like parse does.
+    '''
+    @staticmethod
+    def decode_logs(logs) -> list:
+        to_hex, to_int = TransferScanner._to_hex, TransferScanner._to_int
+        checksum_addresses = {}
+        rows = []
+        for log in logs:
+            topics = log['topics']
+            # same condition as create_transfer_from_json. ERC-20 transfers share the signature but have 3 topics.
+            if len(topics) != 4:
+                continue
+            address = log['address']
+            if address not in checksum_addresses:
+                checksum_addresses[address] = Web3.toChecksumAddress(address)
+            # the last 40 characters of an address topic is the address without its leading zeroes.
+            rows.append({
+                "contract_address": checksum_addresses[address],
+                "log_index": to_int(log['logIndex']),
+                "tx": to_hex(log['transactionHash']),
+                "block": to_int(log['blockNumber']),
+                "token_id": int(to_hex(topics[3]), 16),
+                "from_address": to_hex(topics[1])[-40:],
+                "to_address": to_hex(topics[2])[-40:]
+            })
+        return rows
+
     @staticmethod
     def parse(events):
         json_events = Web3.toJSON(events)
@@ -145,7 +391,9 @@ class TransferScanner:
         # !--- QUERY DATABASE IF COLLECTION EXISTS HERE ---!
         contract_name = self.find_contract_name(checksum_contract_address=checksum_contract_address)
 
-        # local var for chunk size that will be adjusted if an exception is thrown.
+        # local var for chunk size that will be adjusted after every request.
+        controllers = self.chunk_controllers = []
+        controller = self.new_chunk_controller(controllers)
         chunk_size = self.min_chunk_size
         # set end block for current block range scan
         scan_end_block = start_block + chunk_size
@@ -154,25 +402,26 @@ class TransferScanner:
         # scan stats for nerds
         total_blocks_scanned, total_events_found, events_in_chunk, api_calls  = 0, 0, 0, 0
 
-        with self.db.start_session() as session:
+        with self._invalidating_caches({contract_address: start_block}), self.db.start_session() as session:
             (collection_exists, coll) = self.db.collections.collection_exists(session, contract_address)
             if not collection_exists:
                 collection = Collection(contract_address=contract_address,
                                         name=contract_name, start_block=start_block)
                 self.db.collections.add_collection_to_db(db_session=session, collection=collection)
+            else:
+                # the running block statistics cannot take transfers at or below the blocks they already contain.
+                self.db.collection_aggregates.invalidate_from(db_session=session, contract_address=contract_address,
+                                                              block=start_block)
 
             print(f' scanning {contract_name}. block {scan_start_block} --> block {latest_block}')
 
             while scan_end_block <= latest_block:
-                # create filter which only looks for event with given signature hash.
-                signature_filter = self.get_filter(scan_start_block, chunk_size,
-                                                   checksum_contract_address,
-                                                   self.event_signature_hash)
                 # This is the call that actually fetches the data
                 try:
-                    transfers_raw = self.w3.eth.get_filter_logs(signature_filter.filter_id)
-                    # parse json to dict
-                    transfers = self.parse(transfers_raw)
+                    request_start = time.time()
+                    transfers = self.fetch_transfers(scan_start_block, scan_start_block + chunk_size,
+                                                     checksum_contract_address)
+                    request_seconds = time.time() - request_start
                     # store number of events found for calculating block size
                     transfers_found = len(transfers)
                     transfers_added = 0
@@ -180,26 +429,25 @@ class TransferScanner:
                     # !--- INSERT TRANSFERS INTO DATABASE ---!
                     if self.db is not None:
                         if transfers_found > 0:
-                            tl = self.create_transfer_from_json(transfers)
                             transfers_added = self.db.transfers.\
-                                add_transfer_list_to_db(db_session=session, transfer_list=tl,
-                                                        collection_exists=collection_exists)
+                                bulk_add_transfer_list_to_db(db_session=session, transfer_list=transfers)
                     # update scan stats for nerds
                     total_events_found += transfers_found
                     total_blocks_scanned += chunk_size
                     api_calls += 1
 
                     # prepare next scan chunk
-                    # set chunk size with adjust_chunk_size heuristics
-                    chunk_size = self.adjust_chunk_size(transfers_found, chunk_size)
+                    # set chunk size with the estimates of the chunk size controller
+                    chunk_size = controller.record(chunk_size=chunk_size, blocks=chunk_size + 1,
+                                                   events=transfers_found, seconds=request_seconds)
 
                     # need to add 1 to avoid duplicates.
                     scan_start_block = scan_end_block + 1
                     scan_end_block = scan_start_block + chunk_size
-                    if transfers_added > 0:
-                        self.db.collections.set_collection_latest_block(session, contract_address, scan_end_block)
-
                     # update the latest block of the collection. Should allow us to resume from where we ended scan.
+                    # every block before scan_start_block is stored, the insert raises if it fails.
+                    if transfers_added > 0:
+                        self.db.collections.set_collection_latest_block(session, contract_address, scan_start_block)
 
                     if progress_bar is not None:
                         self._update_progress(start=start_block, end=latest_block, current=scan_start_block,
@@ -207,19 +455,399 @@ class TransferScanner:
                                               total_events=total_events_found, total_blocks_scanned=total_blocks_scanned,
                                               api_calls=api_calls, progress_bar=progress_bar)
 
-                # Exception occurs when the API call hits more than 10000 events.
+                # Exception occurs when the API call hits more than 10000 events. Other errors end the scan.
+                except ValueError as e:
+                    if not self.is_range_refused(e):
+                        raise
+                    print(e)
+                    # bisect the refused range instead of starting over from the minimum chunk size.
+                    chunk_size = controller.refuse(chunk_size=chunk_size)
+                    scan_end_block = scan_start_block + chunk_size
+
+        return total_events_found, total_blocks_scanned, api_calls
+
+    @staticmethod
+    def _split_into_shards(start_block: int, end_block: int, shard_size: int) -> list:
+        shards = []
+        shard_start = start_block
+        while shard_start <= end_block:
+            shard_end = min(shard_start + shard_size - 1, end_block)
+            shards.append((shard_start, shard_end))
+            shard_start = shard_end + 1
+        return shards
+
+    # splits the blocks from scan_start_block up to end_block into at most batch_size ranges of chunk_size blocks.
+    def _next_ranges(self, scan_start_block: int, end_block: int, chunk_size: int) -> list:
+        ranges = []
+        while scan_start_block <= end_block and len(ranges) < self.batch_size:
+            scan_end_block = min(scan_start_block + chunk_size, end_block)
+            ranges.append((scan_start_block, scan_end_block))
+            scan_start_block = scan_end_block + 1
+        return ranges
+
+    # scans a single shard using the same adaptive chunk sizing as scan. Runs inside a worker thread, so it only talks
+    # to the node and never to the database. Returns the decoded transfer rows of the shard in block order.
+    def _scan_shard(self, *, checksum_contract_address: str, shard_start: int, shard_end: int, controllers: list,
+                    progress=None):
+        controller = self.new_chunk_controller(controllers)
+        chunk_size = self.min_chunk_size
+        scan_start_block = shard_start
+        transfers, events_found, api_calls = [], 0, 0
+
+        while scan_start_block <= shard_end:
+            ranges = self._next_ranges(scan_start_block, shard_end, chunk_size)
+            request_start = time.time()
+            results = self.fetch_transfers_batch(ranges, checksum_contract_address)
+            request_seconds = time.time() - request_start
+            api_calls += 1
+            # the request counts even when the node refused its first range.
+            if progress is not None:
+                progress(blocks=0, chunk_size=chunk_size, events=0, api_calls=1)
+            batch_events, refused = 0, False
+
+            for (from_block, to_block), chunk in zip(ranges, results):
+                # the range hit the 10000 events limit. Everything after it is fetched again with a smaller chunk size.
+                if chunk is None:
+                    refused = True
+                    break
+                transfers.extend(chunk)
+                events_found += len(chunk)
+                batch_events += len(chunk)
+                scan_start_block = to_block + 1
+                if progress is not None:
+                    progress(blocks=to_block - from_block + 1, chunk_size=chunk_size, events=len(chunk), api_calls=0)
+
+            if refused:
+                chunk_size = controller.refuse(chunk_size=chunk_size)
+            else:
+                # all ranges of a batch are answered together, so the batch shares one latency budget. The last range
+                # of a shard can be shorter than chunk_size, so the blocks are counted from the ranges themselves.
+                chunk_size = controller.record(chunk_size=chunk_size,
+                                               blocks=sum(to_block - from_block + 1 for (from_block, to_block) in ranges),
+                                               events=batch_events, seconds=request_seconds)
+
+        return transfers, events_found, api_calls
+
+    '''
+    parallel version of scan. The block range is split into shards which are fetched by a bounded pool of worker threads.
+    Shards are committed to the database in block order, and the latest block of the collection is only moved past a 
+    shard once it has been committed, so an interrupted scan can always be resumed without skipping blocks.
+    '''
+    def scan_parallel(self, *, contract_address: str, start_block: int, progress_bar=None,
+                      workers: int = 4) -> Tuple[int, int, int]:
+        latest_block = self.get_latest_block()
+        assert start_block <= latest_block
+        assert workers > 0
+
+        checksum_contract_address = Web3.toChecksumAddress(contract_address)
+        contract_name = self.find_contract_name(checksum_contract_address=checksum_contract_address)
+        shards = self._split_into_shards(start_block, latest_block, self.shard_size)
+        controllers = self.chunk_controllers = []
+
+        # scan stats for nerds. Shared between the workers, so they are only updated while holding the lock.
+        stats = {"blocks": 0, "events": 0, "api_calls": 0}
+        lock = threading.Lock()
+
+        def progress(*, blocks, chunk_size, events, api_calls=1):
+            with lock:
+                stats["blocks"] += blocks
+                stats["events"] += events
+                stats["api_calls"] += api_calls
+                if progress_bar is not None:
+                    self._update_progress(start=start_block, end=latest_block, current=None,
+                                          chunk_size=chunk_size, events_in_chunk=events,
+                                          total_events=stats["events"], total_blocks_scanned=stats["blocks"],
+                                          api_calls=stats["api_calls"], progress_bar=progress_bar, advance=blocks)
+
+        with self._invalidating_caches({contract_address: start_block}), self.db.start_session() as session:
+            (collection_exists, coll) = self.db.collections.collection_exists(session, contract_address)
+            if not collection_exists:
+                collection = Collection(contract_address=contract_address,
+                                        name=contract_name, start_block=start_block)
+                self.db.collections.add_collection_to_db(db_session=session, collection=collection)
+            else:
+                # the running block statistics cannot take transfers at or below the blocks they already contain.
+                self.db.collection_aggregates.invalidate_from(db_session=session, contract_address=contract_address,
+                                                              block=start_block)
+
+            print(f' scanning {contract_name} with {workers} workers. block {start_block} --> block {latest_block}')
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                def submit(shard):
+                    return shard, executor.submit(self._scan_shard,
+                                                  checksum_contract_address=checksum_contract_address,
+                                                  shard_start=shard[0], shard_end=shard[1],
+                                                  controllers=controllers, progress=progress)
+
+                # only keep a couple of shards per worker in flight, so finished shards waiting to be committed in
+                # order cannot pile up in memory.
+                remaining = iter(shards)
+                in_flight = deque(submit(shard) for _, shard in zip(range(workers * 2), remaining))
+
+                try:
+                    while in_flight:
+                        (shard_start, shard_end), future = in_flight.popleft()
+                        transfers, _, _ = future.result()
+
+                        # raises if the insert fails, so latest_block is never moved past a shard that is not stored.
+                        if self.db is not None and len(transfers) > 0:
+                            self.db.transfers.bulk_add_transfer_list_to_db(db_session=session, transfer_list=transfers)
+                        # every block up to and including shard_end is now stored.
+                        self.db.collections.set_collection_latest_block(session, contract_address, shard_end + 1)
+
+                        next_shard = next(remaining, None)
+                        if next_shard is not None:
+                            in_flight.append(submit(next_shard))
+                except BaseException:
+                    # the scan resumes from the last committed shard, so the shards that did not start are dropped.
+                    for (_, future) in in_flight:
+                        future.cancel()
+                    raise
+
+        return stats["events"], stats["blocks"], stats["api_calls"]
+
+    '''
+    scans several contracts in a single pass over the chain. Every chunk is fetched with one eth_getLogs call covering all
+    contracts that have reached their start block, and the transfers are routed to their collection by address. Each 
+    collection keeps its own latest_block, so collections that were already scanned further only join the pass once it
+    reaches them. Returns the totals of the pass and a dict with the number of events found per collection.
+    '''
+    def scan_many(self, *, contract_addresses: list, progress_bar=None) -> Tuple[int, int, int, dict]:
+        latest_block = self.get_latest_block()
+        # k = contract address, v = start block, filled while the collections are added to the pass.
+        start_blocks = {}
+
+        with self._invalidating_caches(start_blocks), self.db.start_session() as session:
+            # k = checksum address as returned in the logs, v = (contract address used in the database, start block)
+            collections = {}
+            for contract_address in contract_addresses:
+                contract_address = contract_address.strip()
+                checksum_contract_address = Web3.toChecksumAddress(contract_address)
+                start_block = self.determine_start_block(db_session=session, contract_address=contract_address)
+                if start_block > latest_block:
+                    continue
+
+                (collection_exists, coll) = self.db.collections.collection_exists(session, contract_address)
+                if not collection_exists:
+                    contract_name = self.find_contract_name(checksum_contract_address=checksum_contract_address)
+                    collection = Collection(contract_address=contract_address,
+                                            name=contract_name, start_block=start_block)
+                    self.db.collections.add_collection_to_db(db_session=session, collection=collection)
+                else:
+                    self.db.collection_aggregates.invalidate_from(db_session=session,
+                                                                  contract_address=contract_address, block=start_block)
+                collections[checksum_contract_address] = (contract_address, start_block)
+                start_blocks[contract_address] = start_block
+
+            if len(collections) == 0:
+                return 0, 0, 0, {}
+
+            events_per_collection = {contract_address: 0 for (contract_address, _) in collections.values()}
+            total_blocks_scanned, total_events_found, api_calls = 0, 0, 0
+            controllers = self.chunk_controllers = []
+            controller = self.new_chunk_controller(controllers)
+            chunk_size = self.min_chunk_size
+            start_block = scan_start_block = min(start for (_, start) in collections.values())
+
+            print(f' scanning {len(collections)} collections. block {scan_start_block} --> block {latest_block}')
+            if progress_bar is not None:
+                progress_bar.reset(total=latest_block - scan_start_block + 1)
+
+            while scan_start_block <= latest_block:
+                scan_end_block = min(scan_start_block + chunk_size, latest_block)
+                # only ask for the contracts whose scan has reached this chunk. Never empty, since the pass starts at
+                # the lowest start block.
+                active = [k for k, (_, start) in collections.items() if start <= scan_end_block]
+                try:
+                    request_start = time.time()
+                    transfers = self.fetch_transfers(scan_start_block, scan_end_block, active)
+                    request_seconds = time.time() - request_start
+                # Exception occurs when the API call hits more than 10000 events. Other errors end the scan.
                 except ValueError as e:
+                    if not self.is_range_refused(e):
+                        raise
                     print(e)
-                    scan_end_block -= chunk_size
-                    chunk_size = self.min_chunk_size
+                    chunk_size = controller.refuse(chunk_size=chunk_size)
+                    continue
+
+                for t in transfers:
+                    contract_address = collections[t["contract_address"]][0]
+                    t["contract_address"] = contract_address
+                    events_per_collection[contract_address] += 1
+
+                if len(transfers) > 0:
+                    self.db.transfers.bulk_add_transfer_list_to_db(db_session=session, transfer_list=transfers)
+                self.db.collections.set_collections_latest_block(session, [collections[k][0] for k in active],
+                                                                 scan_end_block + 1)
+
+                total_events_found += len(transfers)
+                total_blocks_scanned += scan_end_block - scan_start_block + 1
+                api_calls += 1
+                if progress_bar is not None:
+                    self._update_progress(start=start_block, end=latest_block, current=scan_start_block,
+                                          chunk_size=chunk_size, events_in_chunk=len(transfers),
+                                          total_events=total_events_found, total_blocks_scanned=total_blocks_scanned,
+                                          api_calls=api_calls, progress_bar=progress_bar,
+                                          advance=scan_end_block - scan_start_block + 1)
+
+                chunk_size = controller.record(chunk_size=chunk_size, blocks=scan_end_block - scan_start_block + 1,
+                                               events=len(transfers), seconds=request_seconds)
+                scan_start_block = scan_end_block + 1
+
+        return total_events_found, total_blocks_scanned, api_calls, events_per_collection
+
+    '''
+    pipelined version of scan. A fetcher thread downloads the chunks, a decoder thread turns them into transfer rows and
+    the calling thread writes them to the database, so network I/O and database writes overlap. The stages are connected
+    by bounded queues, which makes the fetcher wait when the writer falls behind. Chunks are written in block order and
+    latest_block is only moved past a chunk once it has been committed, so a crash never skips blocks.
+    '''
+    def scan_pipelined(self, *, contract_address: str, start_block: int, progress_bar=None,
+                       queue_size: int = 8) -> Tuple[int, int, int]:
+        latest_block = self.get_latest_block()
+        assert start_block <= latest_block
+
+        checksum_contract_address = Web3.toChecksumAddress(contract_address)
+        contract_name = self.find_contract_name(checksum_contract_address=checksum_contract_address)
+
+        raw_queue, row_queue = queue.Queue(maxsize=queue_size), queue.Queue(maxsize=queue_size)
+        # set when the pipeline shuts down, so stages blocked on a full or empty queue can give up.
+        stop = threading.Event()
+        errors = []
 
+        def put(q, item) -> bool:
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        # returns None when the previous stage is done or the pipeline has been stopped.
+        def get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=1)
+                except queue.Empty:
+                    continue
+            return None
+
+        controllers = self.chunk_controllers = []
+        controller = self.new_chunk_controller(controllers)
+
+        def fetcher():
+            try:
+                chunk_size = self.min_chunk_size
+                scan_start_block = start_block
+                while scan_start_block <= latest_block:
+                    scan_end_block = min(scan_start_block + chunk_size, latest_block)
+                    try:
+                        request_start = time.time()
+                        logs = self.fetch_logs(scan_start_block, scan_end_block, checksum_contract_address)
+                        request_seconds = time.time() - request_start
+                    # Exception occurs when the API call hits more than 10000 events. Other errors end the scan.
+                    except ValueError as e:
+                        if not self.is_range_refused(e):
+                            raise
+                        print(e)
+                        chunk_size = controller.refuse(chunk_size=chunk_size)
+                        continue
+                    if not put(raw_queue, (scan_start_block, scan_end_block, chunk_size, logs)):
+                        return
+                    chunk_size = controller.record(chunk_size=chunk_size,
+                                                   blocks=scan_end_block - scan_start_block + 1,
+                                                   events=len(logs), seconds=request_seconds)
+                    scan_start_block = scan_end_block + 1
+            except Exception as e:
+                errors.append(e)
+            finally:
+                put(raw_queue, None)
+
+        def decoder():
+            try:
+                while (item := get(raw_queue)) is not None:
+                    (from_block, to_block, chunk_size, logs) = item
+                    if not put(row_queue, (from_block, to_block, chunk_size, self.decode_logs(logs))):
+                        return
+            except Exception as e:
+                errors.append(e)
+            finally:
+                put(row_queue, None)
+
+        stages = [threading.Thread(target=fetcher, daemon=True), threading.Thread(target=decoder, daemon=True)]
+        total_blocks_scanned, total_events_found, api_calls = 0, 0, 0
+
+        with self._invalidating_caches({contract_address: start_block}), self.db.start_session() as session:
+            (collection_exists, coll) = self.db.collections.collection_exists(session, contract_address)
+            if not collection_exists:
+                collection = Collection(contract_address=contract_address,
+                                        name=contract_name, start_block=start_block)
+                self.db.collections.add_collection_to_db(db_session=session, collection=collection)
+            else:
+                # the running block statistics cannot take transfers at or below the blocks they already contain.
+                self.db.collection_aggregates.invalidate_from(db_session=session, contract_address=contract_address,
+                                                              block=start_block)
+
+            print(f' scanning {contract_name} (pipelined). block {start_block} --> block {latest_block}')
+
+            for stage in stages:
+                stage.start()
+            try:
+                # the writer stage.
+                while (item := get(row_queue)) is not None:
+                    (from_block, to_block, chunk_size, transfers) = item
+                    if len(transfers) > 0:
+                        self.db.transfers.bulk_add_transfer_list_to_db(db_session=session, transfer_list=transfers)
+                    # every block up to and including to_block is now stored.
+                    self.db.collections.set_collection_latest_block(session, contract_address, to_block + 1)
+
+                    total_events_found += len(transfers)
+                    total_blocks_scanned += to_block - from_block + 1
+                    api_calls += 1
+                    if progress_bar is not None:
+                        self._update_progress(start=start_block, end=latest_block, current=from_block,
+                                              chunk_size=chunk_size, events_in_chunk=len(transfers),
+                                              total_events=total_events_found,
+                                              total_blocks_scanned=total_blocks_scanned,
+                                              api_calls=api_calls, progress_bar=progress_bar,
+                                              advance=to_block - from_block + 1)
+            finally:
+                stop.set()
+                for stage in stages:
+                    stage.join()
+
+        if len(errors) > 0:
+            raise errors[0]
         return total_events_found, total_blocks_scanned, api_calls
 
+    # makes the cached api responses and wallet graphs of the scanned collections stale when the scan ends, also when it
+    # fails, because the transfers committed before the error are visible as well. start_blocks maps every scanned
+    # collection to the first block of its scan.
+    @contextmanager
+    def _invalidating_caches(self, start_blocks: dict):
+        try:
+            yield
+        finally:
+            self._invalidate_responses(*start_blocks.keys())
+            if self.wallet_graphs is not None:
+                for (contract_address, start_block) in start_blocks.items():
+                    self.wallet_graphs.invalidate_from(contract_address, start_block)
+
+    # makes the cached api responses of the scanned collections stale, see ResponseCache.
+    def _invalidate_responses(self, *contract_addresses):
+        if self.response_cache is not None:
+            self.response_cache.invalidate(*contract_addresses)
+
     @staticmethod
-    def _update_progress(*, start, end, current, chunk_size, events_in_chunk, total_events, total_blocks_scanned, api_calls, progress_bar):
+    def _update_progress(*, start, end, current, chunk_size, events_in_chunk, total_events, total_blocks_scanned, api_calls,
+                         progress_bar, advance: int = None):
         progress_bar.set_description(f"🚀 chunk_size: { chunk_size } | { total_blocks_scanned }, "
                                      f"events: { events_in_chunk } | { total_events }, api calls: {api_calls}")
-        progress_bar.update(chunk_size)
+        progress_bar.update(chunk_size if advance is None else advance)
+        # progress of background scan jobs also keeps the raw counters, see ScanJobQueue.JobProgress.
+        if hasattr(progress_bar, "set_counters"):
+            progress_bar.set_counters(chunk_size=chunk_size, events=total_events, api_calls=api_calls)
 
     @staticmethod
     def get_start_block_brute(contract_address: str):
@@ -237,8 +865,16 @@ class TransferScanner:
 
     # always tries to find the start-block in our database before looking for it using API calls unless from_first_block
     # is true
-    def scan_with_progressbar(self, *, contract_address, slug: str = None, from_first_block: bool = False):
+    # if workers is larger than 1, the block range is scanned in parallel using scan_parallel. Otherwise pipelined
+    # selects scan_pipelined over scan. Both default to the workers and pipelined settings of the scanner.
+    # if update_statistics is true, the new transfers are folded into the block statistics of the collection afterwards.
+    # progress_bar replaces the tqdm bar, e.g. with the progress of a background job.
+    def scan_with_progressbar(self, *, contract_address, slug: str = None, from_first_block: bool = False,
+                              workers: int = None, pipelined: bool = None, update_statistics: bool = False,
+                              progress_bar=None) -> Tuple[int, int, int]:
         start = time.time()
+        workers = self.workers if workers is None else workers
+        pipelined = self.pipelined if pipelined is None else pipelined
 
         if not from_first_block:
             with self.db.start_session() as session:
@@ -246,18 +882,59 @@ class TransferScanner:
         else:
             start_block = self.collection_service.get_start_block_and_slug(contract_address=contract_address).start_block
 
-        with tqdm(total=self.get_latest_block() - start_block) as progress_bar:
-            total_events_found, total_blocks_scanned, api_calls = self.scan(start_block=start_block,
-                                                                            contract_address=contract_address.strip(),
-                                                                            progress_bar=progress_bar)
-        duration = round(time.time() - start, 0)
+        total = self.get_latest_block() - start_block
+        if progress_bar is not None:
+            progress_bar.reset(total=total)
+        with tqdm(total=total) if progress_bar is None else nullcontext(progress_bar) as progress_bar:
+            if workers > 1:
+                total_events_found, total_blocks_scanned, api_calls = \
+                    self.scan_parallel(start_block=start_block, contract_address=contract_address.strip(),
+                                       progress_bar=progress_bar, workers=workers)
+            elif pipelined:
+                total_events_found, total_blocks_scanned, api_calls = \
+                    self.scan_pipelined(start_block=start_block, contract_address=contract_address.strip(),
+                                        progress_bar=progress_bar)
+            else:
+                total_events_found, total_blocks_scanned, api_calls = \
+                    self.scan(start_block=start_block, contract_address=contract_address.strip(),
+                              progress_bar=progress_bar)
+
+        if update_statistics and self.statistics_service is not None:
+            with self.db.start_session() as session:
+                collection = self.db.collections.get_collection(db_session=session, contract_address=contract_address)
+                self.statistics_service.update_collection_stats_incremental(db_session=session, collection=collection)
 
         if slug is not None:
             print(f'Collection: {slug} || {contract_address}')
+        self._print_scan_summary(start, total_blocks_scanned, total_events_found, api_calls,
+                                 chunk_metrics=self.chunk_metrics())
+        return total_events_found, total_blocks_scanned, api_calls
+
+    # scans all the given contracts in one pass using scan_many and prints the result.
+    def scan_many_with_progressbar(self, *, contract_addresses: list):
+        start = time.time()
+
+        # the total is set by scan_many once the start blocks of the collections are known.
+        with tqdm() as progress_bar:
+            total_events_found, total_blocks_scanned, api_calls, events_per_collection = \
+                self.scan_many(contract_addresses=contract_addresses, progress_bar=progress_bar)
+
+        for contract_address, events_found in events_per_collection.items():
+            print(f'Collection: {contract_address} || events: {events_found:,}')
+        self._print_scan_summary(start, total_blocks_scanned, total_events_found, api_calls,
+                                 chunk_metrics=self.chunk_metrics())
+
+    @staticmethod
+    def _print_scan_summary(start, total_blocks_scanned, total_events_found, api_calls, chunk_metrics: dict = None):
+        duration = round(time.time() - start, 0)
+
         print("Finished in \t" + Fore.GREEN + f"{duration}" + Style.RESET_ALL + " seconds ⏱")
         print("Blocks scanned:\t" + Fore.CYAN + f"{total_blocks_scanned:,}" + Style.RESET_ALL + " 🏁")
         print("Events found: \t" + Fore.CYAN + f"{total_events_found:,}" + Style.RESET_ALL + " 📈")
         print("API calls: \t" + Fore.CYAN + f"{api_calls:,}" + Style.RESET_ALL + " 📣")
+        if chunk_metrics is not None and chunk_metrics["chunks"] > 0:
+            print("Chunks: \t" + Fore.CYAN + f"{chunk_metrics['chunks']:,}" + Style.RESET_ALL +
+                  f" (refused: {chunk_metrics['refused']:,}, decisions: {chunk_metrics['reasons']})")
 
     # calculates the statistics for every entry in our database.
 
@@ -0,0 +1,150 @@
+import os
+import threading
+from collections import OrderedDict
+
+from Models import Session
+from Models.TransferGraph import TransferGraph
+
+
+'''
+Cache of the collection wide wallet graphs. Graphs are kept in an in-memory LRU of max_graphs collections and saved as
+.npz files in cache_dir, so they survive restarts. On every lookup the transfers the scanner added after the last block
+of the cached graph are appended, so the graph is only built from scratch once per collection.
+Transfers stored at or below the last block of a graph, e.g. by a rescan from the first block, cannot be appended. The
+scanner calls invalidate_from with the first block it scans, which removes such graphs. Other processes notice that the
+file of a graph was removed or replaced and load it again.
+Every collection has its own lock, so building the graph of one collection does not block lookups of the others.
+Set cache_dir to None to only cache in memory.
+'''
+class WalletGraphCache:
+
+    def __init__(self, *, db, max_graphs: int = 8, cache_dir: str = "wallet_graphs"):
+        self.db = db
+        self.max_graphs = max_graphs
+        self.cache_dir = cache_dir
+        self._graphs = OrderedDict()
+        # modification time of the file each graph in memory was loaded from or saved to.
+        self._mtimes = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        # metrics
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.extended = 0
+
+    def _path(self, contract_address: str) -> str:
+        return os.path.join(self.cache_dir, contract_address.lower() + ".npz")
+
+    def _mtime(self, contract_address: str):
+        try:
+            return os.path.getmtime(self._path(contract_address))
+        except OSError:
+            return None
+
+    def _collection_lock(self, contract_address: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(contract_address, threading.Lock())
+
+    def _load(self, contract_address: str):
+        if self.cache_dir is None or not os.path.exists(self._path(contract_address)):
+            return None
+        try:
+            mtime = self._mtime(contract_address)
+            graph = TransferGraph.load(self._path(contract_address))
+            self._mtimes[contract_address] = mtime
+            return graph
+        except (OSError, ValueError, KeyError):
+            print(f"could not load cached graph of {contract_address}, rebuilding it.")
+            return None
+
+    def _save(self, contract_address: str, graph: TransferGraph):
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # write to a temporary file first, so a crash does not leave a broken graph behind.
+        tmp_path = self._path(contract_address) + ".tmp.npz"
+        graph.save(tmp_path)
+        os.replace(tmp_path, self._path(contract_address))
+        self._mtimes[contract_address] = self._mtime(contract_address)
+
+    def _remember(self, contract_address: str, graph: TransferGraph):
+        with self._lock:
+            self._graphs[contract_address] = graph
+            self._graphs.move_to_end(contract_address)
+            while len(self._graphs) > self.max_graphs:
+                self._graphs.popitem(last=False)
+
+    # returns the graph in memory, unless another process removed or replaced its file since it was loaded.
+    def _cached(self, contract_address: str):
+        with self._lock:
+            graph = self._graphs.get(contract_address)
+        if graph is not None and self.cache_dir is not None \
+                and self._mtime(contract_address) != self._mtimes.get(contract_address):
+            return None
+        return graph
+
+    '''
+    returns the up to date wallet graph of a collection, or None if the collection does not exist. Graphs are only
+    built and saved for collections in the database, so unknown addresses do not fill cache_dir.
+    '''
+    def get(self, *, db_session: Session, contract_address: str) -> TransferGraph:
+        with self._collection_lock(contract_address):
+            graph = self._cached(contract_address)
+            if graph is not None:
+                self.hits += 1
+            else:
+                graph = self._load(contract_address)
+                if graph is not None:
+                    self.disk_hits += 1
+                else:
+                    self.misses += 1
+
+            if graph is None:
+                (collection_exists, _) = self.db.collections.collection_exists(db_session, contract_address)
+                if not collection_exists:
+                    return None
+                transfers = self.db.transfers.get_graph_transfers_from_collection(db_session=db_session,
+                                                                                  contract_address=contract_address)
+                graph = TransferGraph.from_transfers(transfers)
+                self._save(contract_address, graph)
+            else:
+                transfers = self.db.transfers.get_graph_transfers_from_collection(db_session=db_session,
+                                                                                  contract_address=contract_address,
+                                                                                  after_block=graph.last_block)
+                if len(transfers) > 0:
+                    self.extended += 1
+                    graph = graph.extend(transfers)
+                    self._save(contract_address, graph)
+
+            self._remember(contract_address, graph)
+            return graph
+
+    def invalidate(self, contract_address: str):
+        with self._collection_lock(contract_address):
+            with self._lock:
+                self._graphs.pop(contract_address, None)
+            if self.cache_dir is not None and os.path.exists(self._path(contract_address)):
+                os.remove(self._path(contract_address))
+
+    '''
+    removes the graph of a collection if transfers from block on can no longer be appended to it, because the graph
+    already contains later blocks. Graphs that end before block are kept and extended on the next lookup.
+    '''
+    def invalidate_from(self, contract_address: str, block: int):
+        graph = self._cached(contract_address)
+        if graph is not None:
+            last_block = graph.last_block
+        elif self.cache_dir is not None and os.path.exists(self._path(contract_address)):
+            try:
+                last_block = TransferGraph.load_last_block(self._path(contract_address))
+            except (OSError, ValueError, KeyError):
+                last_block = block
+        else:
+            return
+        if block <= last_block:
+            self.invalidate(contract_address)
+
+    def metrics(self) -> dict:
+        return {"graphs": len(self._graphs), "hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "extended": self.extended}
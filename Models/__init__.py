@@ -1,8 +1,10 @@
 from dotenv import load_dotenv
 import os
+import threading
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import create_engine, MetaData
+from sqlalchemy.engine import make_url
 from sqlalchemy_utils import create_database, database_exists
 
 
@@ -10,17 +12,36 @@ load_dotenv()
 
 entities = ["slugs", "collections", "transfers"]
 
-# if the database does not exist, we create it and let the database model know that the tables must also be created.
-# apparently, if can create the tables no matter where the db mappings are located?
-engine = create_engine(os.getenv("connection_string"))
 Base = declarative_base()
-Session = sessionmaker(bind=engine, future=True)
+# the session factory is bound to the engine the first time get_engine is called.
+Session = sessionmaker(future=True)
 metadata_obj = MetaData()
 
-db_already_exists = database_exists(engine.url)
-if not db_already_exists:
-    create_database(engine.url)
-tables_exist = len(engine.table_names()) == len(entities)
+_engine = None
+_engine_lock = threading.Lock()
+
+
+# creates the engine on first use instead of at import, so importing Models does not need a database.
+# if the database does not exist, we create it. The tables are created by the DatabaseModel.
+# there is only one engine per process, so every DatabaseModel shares its connection pool.
+def get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            url = make_url(os.getenv("connection_string"))
+            pool_options = {}
+            if url.get_backend_name() != "sqlite":
+                pool_options = {
+                    "pool_size": int(os.getenv("DB_POOL_SIZE", 10)),
+                    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 20)),
+                    "pool_recycle": 3600
+                }
+            engine = create_engine(url, pool_pre_ping=True, **pool_options)
+            if not database_exists(engine.url):
+                create_database(engine.url)
+            Session.configure(bind=engine)
+            _engine = engine
+    return _engine
 
 EVENT_SIGNATURE_HASH = ["0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"]
 CONTRACT_NAME_ABI = """
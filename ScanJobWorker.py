@@ -0,0 +1,23 @@
+from dotenv import load_dotenv
+import time
+from Models import ApplicationContext
+from rich.traceback import install
+
+install()
+load_dotenv()
+
+# runs the scan jobs that the api queues, in a process of its own. gunicorn.conf.py starts one next to the api
+# workers, so the number of concurrent scans is SCAN_JOB_WORKERS no matter how many api workers there are, and
+# recycling an api worker does not interrupt a scan.
+def run(check_interval: float = 60.0):
+    scan_jobs = ApplicationContext.get_context().scan_jobs
+    try:
+        while True:
+            # also restarts worker threads that died.
+            scan_jobs.start()
+            time.sleep(check_interval)
+    except KeyboardInterrupt:
+        scan_jobs.stop()
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,85 @@
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# benchmarks the GET endpoints of Api.setup under concurrent load against a running server, e.g.
+#   gunicorn -c gunicorn.conf.py "ApiMain:create_app()"
+#   python benchmark_api.py --url http://127.0.0.1:5000 --concurrency 16 --requests 200
+# the collection and token are taken from /collection/all and /collection/<id> unless they are given.
+
+
+def endpoints(collection: str, token: int) -> dict:
+    return {
+        "index": "/",
+        "all collections": "/collection/all",
+        "collection tokens": f"/collection/{collection}",
+        "collection stats": f"/collection/{collection}/stats",
+        "token graph": f"/collection/{collection}/token/{token}",
+        "token graph compact": f"/collection/{collection}/token/{token}?format=compact",
+        "token stats": f"/collection/{collection}/token/{token}/stats",
+        "components": f"/collection/{collection}/components",
+    }
+
+
+def discover(http: requests.Session, url: str):
+    collections = http.get(url + "/collection/all").json()
+    if len(collections) == 0:
+        raise SystemExit("no collections in the database, pass --collection and --token.")
+    collection = collections[0]["contract_address"]
+    tokens = http.get(url + f"/collection/{collection}").json()
+    token = tokens[0]["token_id"] if len(tokens) > 0 else 0
+    return collection, token
+
+
+def run(http: requests.Session, url: str, n: int, concurrency: int) -> dict:
+    def call(_):
+        start = time.perf_counter()
+        response = http.get(url)
+        return time.perf_counter() - start, response.status_code, len(response.content)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(call, range(n)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(r[0] for r in results)
+    return {
+        "rps": n / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p95": latencies[int(0.95 * (n - 1))] * 1000,
+        "max": latencies[-1] * 1000,
+        "errors": sum(1 for r in results if r[1] >= 400),
+        "bytes": results[0][2]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the api endpoints under concurrent load")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--collection", default=None)
+    parser.add_argument("--token", type=int, default=None)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100)
+    args = parser.parse_args()
+
+    http = requests.Session()
+    http.mount("http://", HTTPAdapter(pool_connections=args.concurrency, pool_maxsize=args.concurrency))
+    url = args.url.rstrip("/")
+    (collection, token) = (args.collection, args.token)
+    if collection is None or token is None:
+        (collection, token) = discover(http, url)
+
+    print(f"{'endpoint':<22}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'errors':>8}{'bytes':>10}")
+    for (name, path) in endpoints(collection, token).items():
+        http.get(url + path)  # warm up caches and connections
+        r = run(http, url + path, args.requests, args.concurrency)
+        print(f"{name:<22}{r['rps']:>10.1f}{r['p50']:>10.1f}{r['p95']:>10.1f}{r['max']:>10.1f}{r['errors']:>8}"
+              f"{r['bytes']:>10}")
+
+
+if __name__ == '__main__':
+    main()
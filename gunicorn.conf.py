@@ -0,0 +1,37 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+
+# gunicorn -c gunicorn.conf.py "ApiMain:create_app()"
+# Every worker is a separate process with its own pool of up to DB_POOL_SIZE + DB_MAX_OVERFLOW database connections,
+# so API_WORKERS times that has to fit in the connection limit of the database.
+bind = os.getenv("API_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("API_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("API_THREADS", 4))
+worker_class = "gthread"
+timeout = int(os.getenv("API_TIMEOUT", 120))
+# restart workers now and then, so memory held by large responses is given back. This does not interrupt scans, since
+# the workers only queue them.
+max_requests = int(os.getenv("API_MAX_REQUESTS", 1000))
+max_requests_jitter = 100
+accesslog = "-"
+
+# the api workers only queue scan jobs. They are run by one ScanJobWorker.py process that the master starts, so at
+# most SCAN_JOB_WORKERS scans run at once. Set SCAN_JOB_PROCESS=false to run ScanJobWorker.py elsewhere.
+os.environ["SCAN_JOB_AUTOSTART"] = "false"
+scan_job_process = os.getenv("SCAN_JOB_PROCESS", "true").lower() == "true"
+
+
+def when_ready(server):
+    if scan_job_process:
+        server.scan_job_worker = subprocess.Popen(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "ScanJobWorker.py")])
+        server.log.info("started scan job worker (pid: %s)", server.scan_job_worker.pid)
+
+
+def on_exit(server):
+    scan_job_worker = getattr(server, "scan_job_worker", None)
+    if scan_job_worker is not None:
+        scan_job_worker.terminate()
+        scan_job_worker.wait()
@@ -1,7 +1,6 @@
 from dotenv import load_dotenv
 import os
-from Models import DatabaseModel, GraphService, TransferScanner, \
-    CollectionService, ApiView, OpenSeaScraper, StatisticsService
+from Models import ApiView, ApplicationContext
 from rich.traceback import install
 
 install()
@@ -12,8 +11,12 @@ etherscan_api_key = os.getenv("ETHERSCAN_API_KEY")
 
 def api_main():
     (db, graphs, col_service, scanner, scraper, stats) = instantiate_main_objects()
-    api = ApiView.Api(db_model=db, graph_service=graphs, transfer_scanner=scanner, statistics_service=stats)
+    scan_jobs = ApplicationContext.get_context().scan_jobs
+    api = ApiView.Api(db_model=db, graph_service=graphs, transfer_scanner=scanner, statistics_service=stats,
+                      scan_jobs=scan_jobs, response_cache=ApplicationContext.get_context().response_cache)
     api.setup()
+    if scan_jobs.autostart:
+        scan_jobs.start()
     api.start_api()
 
 def main():
@@ -32,14 +35,9 @@ def main():
         print(block_stats)
         print(cycle_stats)
 
+# the objects are built once per process by the application context and reused by every call.
 def instantiate_main_objects():
-    db = DatabaseModel.DatabaseModel()
-    col_service = CollectionService.CollectionService()
-    graphs = GraphService.GraphService(db=db)
-    stats_service = StatisticsService.StatisticsService(db=db, graph_service=graphs)
-    scanner = TransferScanner.TransferScanner(infura_url, log_mode=True, db=db, collection_service=col_service)
-    scraper = OpenSeaScraper.OpenSeaScraper(db=db, etherscan_api_key=etherscan_api_key)
-    return db, graphs, col_service, scanner, scraper, stats_service
+    return ApplicationContext.get_context().as_tuple()
 
 def scan_all_slugs():
     (db, graphs, col_service, scanner, scraper, stats) = instantiate_main_objects()
@@ -51,12 +49,12 @@ def scan_all_slugs():
         if len(slugs) == 0:
             return -1
 
-        for s in slugs:
-            try:
-                scan_single(s.contract_address)
-            except Exception as e:
-                print(f'could not start scan\n{e}')
-                continue
+        # all slugs are scanned in a single pass over the chain instead of one scan per slug.
+        try:
+            scanner.scan_many_with_progressbar(contract_addresses=[s.contract_address for s in slugs])
+        except Exception as e:
+            print(f'could not start scan\n{e}')
+            return -1
 
         return 1
 
@@ -66,12 +64,18 @@ def estimate_start_block(contract_address: str):
 
     print(col_service.get_start_block_and_slug(contract_address=contract_address))
 
-def scan_single(contract_address: str, from_first_block: bool = False):
+# the new transfers are folded into the block statistics of the collection afterwards, see
+# StatisticsService.update_collection_stats_incremental. workers and pipelined default to SCAN_WORKERS and SCAN_PIPELINED.
+def scan_single(contract_address: str, from_first_block: bool = False, update_statistics: bool = True,
+                workers: int = None, pipelined: bool = None):
     (db, graphs, col_service, scanner, scraper, stats) = instantiate_main_objects()
 
     scanner.scan_with_progressbar(
         contract_address=contract_address,
-        from_first_block=from_first_block
+        from_first_block=from_first_block,
+        update_statistics=update_statistics,
+        workers=workers,
+        pipelined=pipelined
     )
     # scanner.scan(
     #     contract_address=contract_address
@@ -81,6 +85,16 @@ def populate_statistics():
     (db, graphs, col_service, scanner, scraper, stats) = instantiate_main_objects()
     stats.populate_collection_stats()
 
+# same as populate_statistics, but spreads the collections over a process per core.
+def populate_statistics_parallel(processes: int = None):
+    (db, graphs, col_service, scanner, scraper, stats) = instantiate_main_objects()
+    stats.populate_collection_stats_parallel(processes=processes)
+
+# block statistics only, calculated by the database. See StatisticsService.insert_collections_stats_sql.
+def populate_statistics_sql():
+    (db, graphs, col_service, scanner, scraper, stats) = instantiate_main_objects()
+    stats.populate_collection_stats_sql()
+
 def insert_statistics_collection(contract_address: str):
     (db, graphs, col_service, scanner, scraper, stats) = instantiate_main_objects()
     with db.start_session() as session:
@@ -127,6 +141,7 @@ if __name__ == '__main__':
     api_main()
     # main()
     # populate_statistics()
+    # populate_statistics_sql()
     # insert_statistics_collection()
     # estimate_start_block("0x6080B6D2C02E9a0853495b87Ce6a65e353b74744")
     # test(1, 100)
@@ -0,0 +1,55 @@
+import random
+
+import networkx as nx
+import pytest
+
+from Models.CycleCounter import CycleCounter
+
+
+def random_edges(seed: int, nodes: int = 9, edges: int = 25) -> list:
+    rng = random.Random(seed)
+    # addresses instead of ints, duplicates and self-loops like in the transfers of a token.
+    return [(f"0x{rng.randrange(nodes):040x}", f"0x{rng.randrange(nodes):040x}") for _ in range(edges)]
+
+
+def networkx_count(edges, length_bound=None) -> int:
+    graph = nx.DiGraph()
+    graph.add_edges_from(edges)
+    return len(list(nx.simple_cycles(graph, length_bound=length_bound)))
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_count_matches_networkx(seed):
+    edges = random_edges(seed)
+    result = CycleCounter().count_edges(edges)
+    assert result.count == networkx_count(edges)
+    assert not result.truncated
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("max_length", [1, 2, 3, 5])
+def test_max_length_matches_networkx_length_bound(seed, max_length):
+    edges = random_edges(seed)
+    assert CycleCounter(max_length=max_length).count_edges(edges).count == networkx_count(edges, max_length)
+
+
+@pytest.mark.parametrize("edges, expected", [
+    ([], 0),
+    ([("a", "b")], 0),
+    ([("a", "a"), ("a", "a")], 1),
+    ([("a", "b"), ("b", "a"), ("a", "b")], 1),
+    ([("a", "b"), ("b", "c"), ("c", "a"), ("c", "b")], 2),
+])
+def test_small_graphs(edges, expected):
+    assert CycleCounter().count_edges(edges).count == expected
+    assert networkx_count(edges) == expected
+
+
+def test_work_budget_gives_lower_bound():
+    # the complete graph on 7 nodes has 2365 simple cycles.
+    edges = [(u, v) for u in range(7) for v in range(7) if u != v]
+    expected = networkx_count(edges)
+    result = CycleCounter(work_budget=100).count_edges(edges)
+    assert result.truncated
+    assert 0 < result.count < expected
+    assert CycleCounter().count_edges(edges).count == expected
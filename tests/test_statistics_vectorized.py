@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+from Entities.Transfer import Transfer
+from Models.StatisticsService import StatisticsService, MINT_ADDRESS
+
+
+# rows like get_ordered_transfers_from_collection returns them, ordered by token id and then by block.
+def make_transfers(seed: int, tokens: int = 40) -> list:
+    rng = random.Random(seed)
+    transfers = []
+    for token_id in range(tokens):
+        block = rng.randint(0, 1000)
+        transfers.append((Transfer(token_id=token_id, block=block, from_address=MINT_ADDRESS),))
+        for _ in range(rng.choice([0, 1, 3, 4, 6, 10])):
+            # 0 often, so tokens where every diff is 0 and repeated extremes are covered.
+            block += rng.choice([0, 0, 1, 5, rng.randint(0, 5000)])
+            transfers.append((Transfer(token_id=token_id, block=block, from_address="a" * 40),))
+    return transfers
+
+
+def vectorized(transfers, min_nr_of_transfers=3):
+    (token_ids, blocks, is_mint) = StatisticsService.transfers_to_arrays(transfers=transfers)
+    return StatisticsService.calculate_statistics_collection_vectorized(token_ids=token_ids, blocks=blocks,
+                                                                       is_mint=is_mint,
+                                                                       min_nr_of_transfers=min_nr_of_transfers)
+
+
+def assert_same_statistics(expected, actual):
+    # numpy sums the squared deviations in a different order, so only the standard deviations may differ in the
+    # last digits.
+    assert actual.std_deviation == pytest.approx(expected.std_deviation, rel=1e-12, abs=1e-12)
+    expected, actual = dict(vars(expected)), dict(vars(actual))
+    expected.pop("std_deviation")
+    actual.pop("std_deviation")
+    assert actual == expected
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("min_nr_of_transfers", [1, 3])
+def test_vectorized_matches_loop(seed, min_nr_of_transfers):
+    transfers = make_transfers(seed)
+    (expected_collection, expected_tokens) = StatisticsService.calculate_statistics_collection(
+        transfers=transfers, min_nr_of_transfers=min_nr_of_transfers)
+    (actual_collection, actual_tokens) = vectorized(transfers, min_nr_of_transfers)
+
+    assert len(expected_tokens) > 0
+    assert_same_statistics(expected_collection, actual_collection)
+    assert list(actual_tokens) == list(expected_tokens)
+    for token_id in expected_tokens:
+        assert actual_tokens[token_id]["blocks"] == expected_tokens[token_id]["blocks"]
+        assert_same_statistics(expected_tokens[token_id]["stats"], actual_tokens[token_id]["stats"])
+
+
+@pytest.mark.parametrize("transfers", [
+    [],
+    [(Transfer(token_id=1, block=10, from_address=MINT_ADDRESS),)],
+    [(Transfer(token_id=1, block=b, from_address="a" * 40),) for b in (10, 20, 30)],
+])
+def test_vectorized_matches_loop_without_valid_tokens(transfers):
+    (expected_collection, expected_tokens) = StatisticsService.calculate_statistics_collection(transfers=transfers)
+    (actual_collection, actual_tokens) = vectorized(transfers)
+
+    assert_same_statistics(expected_collection, actual_collection)
+    assert actual_tokens == expected_tokens
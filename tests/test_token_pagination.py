@@ -0,0 +1,94 @@
+import random
+
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from Models import Base
+from Models.Pagination import Pagination
+from Entities.Collection import Collection
+from Entities.Token import Token
+
+CONTRACT_ADDRESS = "0x" + "ab" * 20
+
+
+@pytest.fixture(scope="module")
+def db_session():
+    engine = create_engine("sqlite://", future=True)
+    Base.metadata.create_all(engine)
+    rng = random.Random(0)
+    with Session(engine, future=True) as session:
+        session.add(Collection(contract_address=CONTRACT_ADDRESS, name="test", start_block=0, latest_block=0))
+        # few distinct values, so most pages end in the middle of a tie, and some tokens have no statistics yet.
+        # inserted with core, because the orm would replace None with the column defaults.
+        session.execute(insert(Token), [{"contract_address": CONTRACT_ADDRESS, "token_id": token_id,
+                                         "transfer_count": rng.choice([None, 1, 2, 3, 3, 3]),
+                                         "cycle_count": rng.choice([None, 0.0, 0.5, 2.0]),
+                                         "block_diff_average": rng.choice([None, 10.25, 100.5, 1000.0])}
+                                        for token_id in range(200)])
+        # a token of another collection must not show up.
+        session.add(Token(contract_address="0x" + "cd" * 20, token_id=1, transfer_count=3))
+        session.commit()
+        yield session
+
+
+def all_pages(db_session, sort, descending, limit, ranges=None) -> list:
+    token_ids = []
+    after = None
+    while True:
+        tokens = Token.get_tokens_in_collection(db_session=db_session, contract_address=CONTRACT_ADDRESS, sort=sort,
+                                                descending=descending, limit=limit, after=after, ranges=ranges)
+        assert len(tokens) <= limit
+        token_ids += [t.token_id for t in tokens]
+        # a cursor that repeats tokens would never reach the last page.
+        assert len(token_ids) <= 200
+        if len(tokens) < limit:
+            return token_ids
+        # round trip through the cursor the api hands out.
+        cursor = Pagination.encode_cursor(Token.cursor_values(tokens[-1], sort))
+        after = Pagination.decode_cursor(cursor, 2)
+
+
+def expected_order(db_session, sort, descending, ranges=None) -> list:
+    tokens = db_session.query(Token).filter(Token.contract_address == CONTRACT_ADDRESS).all()
+    tokens = [t for t in tokens if getattr(t, sort) is not None]
+    for (column, (low, high)) in (ranges or {}).items():
+        # like in sql, a NULL value is never inside a range.
+        tokens = [t for t in tokens if getattr(t, column) is not None and (low is None or getattr(t, column) >= low)
+                  and (high is None or getattr(t, column) <= high)]
+    tokens.sort(key=lambda t: (getattr(t, sort), t.token_id), reverse=descending)
+    return [t.token_id for t in tokens]
+
+
+@pytest.mark.parametrize("sort", Token.SORT_COLUMNS)
+@pytest.mark.parametrize("descending", [True, False])
+@pytest.mark.parametrize("limit", [1, 7, 50, 1000])
+def test_pages_neither_skip_nor_repeat_tokens(db_session, sort, descending, limit):
+    token_ids = all_pages(db_session, sort, descending, limit)
+    assert len(token_ids) == len(set(token_ids))
+    assert token_ids == expected_order(db_session, sort, descending)
+
+
+@pytest.mark.parametrize("descending", [True, False])
+def test_pages_with_ranges(db_session, descending):
+    ranges = {"transfer_count": (2, None), "block_diff_average": (None, 100.5)}
+    token_ids = all_pages(db_session, "cycle_count", descending, 4, ranges)
+    assert token_ids == expected_order(db_session, "cycle_count", descending, ranges)
+
+
+def test_tokens_without_sort_value_are_left_out(db_session):
+    token_ids = set(all_pages(db_session, "transfer_count", True, 10))
+    null_ids = {t.token_id for t in db_session.query(Token).filter(Token.contract_address == CONTRACT_ADDRESS,
+                                                                   Token.transfer_count.is_(None))}
+    assert len(null_ids) > 0
+    assert token_ids.isdisjoint(null_ids)
+    assert len(token_ids) + len(null_ids) == 200
+
+
+def test_invalid_cursor_and_sort_are_rejected():
+    with pytest.raises(ValueError):
+        Pagination.decode_cursor("not a cursor", 2)
+    with pytest.raises(ValueError):
+        Pagination.decode_cursor(Pagination.encode_cursor([1]), 2)
+    with pytest.raises(ValueError):
+        Token.get_tokens_in_collection(db_session=None, contract_address=CONTRACT_ADDRESS, sort="token_id")